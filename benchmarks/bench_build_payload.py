@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for DOSA packet building.
+
+Compares the original slice-by-slice bytearray builder against PacketBuilder.
+
+    python3 benchmarks/bench_build_payload.py
+"""
+
+import os
+import secrets
+import struct
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from dosa.comms import Messages, PacketBuilder  # noqa: E402
+
+DEVICE_NAME = b"DOSA Security Bot"
+BASE_PAYLOAD_SIZE = 27
+
+
+def legacy_build_payload(device_name, cmd, aux_data=b''):
+    """
+    The builder as it was before PacketBuilder.
+    """
+    size = len(aux_data) + BASE_PAYLOAD_SIZE
+    device_name_size = len(device_name)
+
+    payload = bytearray()
+    payload[0:2] = secrets.token_bytes(2)
+    payload[2:5] = cmd
+    payload[5:2] = struct.pack("<H", size)
+    payload[7:7 + device_name_size] = device_name
+
+    if device_name_size < 20:
+        for i in range(7 + device_name_size, BASE_PAYLOAD_SIZE):
+            payload[i:i + 1] = b'\0'
+
+    if size > BASE_PAYLOAD_SIZE:
+        payload[BASE_PAYLOAD_SIZE:] = aux_data
+
+    return payload
+
+
+def rate(fn, number):
+    best = min(timeit.repeat(fn, number=number, repeat=5))
+    return number / best
+
+
+def main(number=200000):
+    builder = PacketBuilder(DEVICE_NAME)
+    cases = {
+        "ping": (Messages.PING, b''),
+        "ack": (Messages.ACK, b'\x12\x34'),
+        "net_log": (Messages.LOG, b'\x14' + b"Device unresponsive: Front Door at 10.0.0.21:6901"),
+    }
+
+    # Both builders must agree on everything but the random message ID
+    for cmd, aux in cases.values():
+        assert legacy_build_payload(DEVICE_NAME, cmd, aux)[2:] == builder.build(cmd, aux)[2:]
+
+    print("packets built per second".rjust(50))
+    print("case".ljust(10) + "legacy".rjust(14) + "build".rjust(14) + "speed-up".rjust(12))
+    for name, (cmd, aux) in cases.items():
+        legacy = rate(lambda: legacy_build_payload(DEVICE_NAME, cmd, aux), number)
+        new = rate(lambda: builder.build(cmd, aux), number)
+        print(name.ljust(10) + str(int(legacy)).rjust(14) + str(int(new)).rjust(14) +
+              ("x" + str(round(new / legacy, 1))).rjust(12))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the receive and send hot path: building payloads, parsing messages and retransmit suppression.
+
+    python3 benchmarks/bench_comms.py
+"""
+
+import common
+from common import dosa, PacketBuilder
+
+
+def bench_build_payload():
+    builder = PacketBuilder(b"DOSA Security Bot")
+    aux = b'\x14' + b"Device unresponsive: Front Door at 10.0.0.21:6901"
+    items = range(100000)
+
+    return {
+        "build_payload.ping": common.result(common.measure(lambda _: builder.build(dosa.Messages.PING), items)),
+        "build_payload.log": common.result(common.measure(lambda _: builder.build(dosa.Messages.LOG, aux), items)),
+    }
+
+
+def bench_parse():
+    traffic = common.make_traffic(100)
+
+    def parse(item):
+        msg = dosa.Message(item[0], item[1])
+        return msg.msg_id, msg.msg_code, msg.device_name, msg.body
+
+    return {"message.parse": common.result(common.measure(parse, traffic))}
+
+
+def bench_message_log(fleet_sizes):
+    results = {}
+
+    for size in fleet_sizes:
+        traffic = common.make_traffic(size)
+
+        def check(msg):
+            log.check(msg.addr, msg.msg_id)
+
+        # A fresh log per pass, so every pass sees the same mix of new messages and retransmits, and fresh Messages
+        # so the msg_id decode isn't cached from an earlier pass
+        best = 0
+        for _ in range(3):
+            msgs = [dosa.Message(packet, addr) for packet, addr in traffic]
+            log = dosa.MessageLog()
+            best = max(best, common.measure(check, msgs, repeat=1))
+
+        results["message_log.check." + str(size)] = common.result(best, fleet=size)
+
+    return results
+
+
+def run(fleet_sizes=common.FLEET_SIZES):
+    results = {}
+    results.update(bench_build_payload())
+    results.update(bench_parse())
+    results.update(bench_message_log(fleet_sizes))
+    return results
+
+
+if __name__ == "__main__":
+    for name, record in run().items():
+        print(name.ljust(32) + str(record["ops_per_sec"]).rjust(12) + " /s")
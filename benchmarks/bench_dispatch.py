@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for packet handling: SecBot.check_for_packets (dedupe and dispatch) and Monitor formatting.
+
+SecBot is built by its own constructor with its AWS session, TTS and config swapped for stubs, so no credentials,
+audio or sockets are needed; network, TTS and alert output go to null sinks. SecBot needs boto3 to import and is
+skipped without it.
+
+Messages are parsed afresh for every pass, as their fields are decoded on first access and cached.
+
+    python3 benchmarks/bench_dispatch.py
+"""
+
+import contextlib
+import io
+from unittest import mock
+
+import common
+from common import dosa
+
+
+class ReplayComms:
+    """
+    Stands in for Comms, returning pre-parsed messages from receive() and discarding anything sent.
+    """
+
+    def __init__(self, msgs):
+        self.msgs = msgs
+        self.next = 0
+        self.device_name = b"DOSA Security Bot"
+
+    def receive(self, timeout=None):
+        msg = self.msgs[self.next]
+        self.next += 1
+        return msg
+
+    def send(self, *args, **kwargs):
+        pass
+
+    def send_ack(self, msg_id, tgt):
+        pass
+
+    def send_command(self, *args, **kwargs):
+        pass
+
+    def net_log(self, level, msg):
+        pass
+
+    def close(self):
+        pass
+
+
+class NullTts:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def announce(self, msg, priority=None):
+        pass
+
+    def prewarm(self, phrases):
+        return []
+
+    def pending(self):
+        return 0
+
+    def set_metrics(self, metrics):
+        pass
+
+    def stop(self):
+        pass
+
+
+class NullSession:
+    """
+    Stands in for a boto3 Session, its SNS client is never called as no alert end-points are configured.
+    """
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def client(self, *args, **kwargs):
+        return None
+
+
+def make_secbot(comms, metrics=False):
+    """
+    A SecBot built by its own constructor, with Polly, SNS and the config file stubbed out.
+    """
+    from dosa import secbot
+
+    settings = {"metrics": {"enabled": metrics}}
+    with mock.patch.object(secbot, "Tts", NullTts), mock.patch.object(secbot, "Session", NullSession), \
+            mock.patch.object(dosa, "get_config", lambda: settings):
+        return secbot.SecBot(comms)
+
+
+def bench_secbot(fleet_sizes):
+    try:
+        import boto3  # noqa: F401
+    except ImportError:
+        print("SecBot benchmarks skipped: boto3 is not installed")
+        return {}
+
+    results = {}
+
+    for size in fleet_sizes:
+        traffic = common.make_traffic(size)
+        results["secbot.check_for_packets." + str(size)] = common.result(measure_secbot(traffic), fleet=size)
+
+    # The cost of hot-path instrumentation
+    traffic = common.make_traffic(100)
+    results["secbot.check_for_packets.metrics.100"] = common.result(measure_secbot(traffic, metrics=True), fleet=100)
+
+    return results
+
+
+def parse(traffic):
+    return [dosa.Message(packet, addr) for packet, addr in traffic]
+
+
+def measure_secbot(traffic, metrics=False):
+    best = 0
+    for _ in range(3):
+        msgs = parse(traffic)
+
+        # Construction and announcements print, keep them out of the report
+        with contextlib.redirect_stdout(io.StringIO()):
+            bot = make_secbot(ReplayComms(msgs), metrics)
+            best = max(best, common.measure(lambda _: bot.check_for_packets(), msgs, repeat=1))
+            bot.stop()
+
+    return best
+
+
+def bench_monitor(fleet_sizes):
+    results = {}
+
+    for size in fleet_sizes:
+        traffic = common.make_traffic(size)
+
+        # A fresh Monitor and fresh Messages per pass, so every pass pays for decoding
+        best = 0
+        for _ in range(3):
+            msgs = parse(traffic)
+            monitor = dosa.Monitor(comms=ReplayComms(msgs), map=True)
+
+            def format_msg(msg):
+                monitor.format(msg, monitor.history.check(msg.addr, msg.msg_id))
+
+            best = max(best, common.measure(format_msg, msgs, repeat=1))
+
+        results["monitor.format." + str(size)] = common.result(best, fleet=size)
+
+    return results
+
+
+def run(fleet_sizes=common.FLEET_SIZES):
+    results = {}
+    results.update(bench_secbot(fleet_sizes))
+    results.update(bench_monitor(fleet_sizes))
+    return results
+
+
+if __name__ == "__main__":
+    for name, record in run().items():
+        print(name.ljust(40) + str(record["ops_per_sec"]).rjust(12) + " /s")
@@ -0,0 +1,89 @@
+"""
+Shared helpers for the benchmark suite: synthetic traffic and timing.
+"""
+
+import os
+import random
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import dosa  # noqa: E402
+from dosa.comms import PacketBuilder  # noqa: E402
+
+FLEET_SIZES = (10, 100, 1000)
+
+# Packet rates a SecBot should sustain, for reporting utilisation against measured throughput
+TARGET_RATES = (1000, 5000, 10000, 50000)
+
+
+def make_fleet(size):
+    """
+    (device name, address, PacketBuilder) for a fleet of `size` devices.
+    """
+    fleet = []
+    for i in range(size):
+        name = "Device " + str(i + 1).zfill(4)
+        fleet.append((name, ("10.0." + str(i // 250) + "." + str(i % 250 + 1), 6901), PacketBuilder(name.encode())))
+
+    return fleet
+
+
+def make_traffic(fleet_size, count=20000, retry_share=0.1, seed=1):
+    """
+    A realistic mix of received packets as (bytes, addr), mostly triggers with a share of IR grid maps, plus pongs,
+    logs and security alerts. A share of packets are repeated, as devices retransmit until ACK'd.
+    """
+    rnd = random.Random(seed)
+    fleet = make_fleet(fleet_size)
+    traffic = []
+
+    while len(traffic) < count:
+        _, addr, builder = rnd.choice(fleet)
+        kind = rnd.random()
+
+        if kind < 0.5:
+            aux = struct.pack("<BHH", dosa.TriggerType.RANGING, rnd.randrange(200, 2000), rnd.randrange(200, 2000))
+            packet = builder.build(dosa.Messages.TRIGGER, aux)
+        elif kind < 0.7:
+            aux = struct.pack("<B", dosa.TriggerType.IR_GRID) + bytes(rnd.randrange(0, 50) for _ in range(64))
+            packet = builder.build(dosa.Messages.TRIGGER, aux)
+        elif kind < 0.9:
+            packet = builder.build(dosa.Messages.PONG, struct.pack("<BB", dosa.DeviceType.SONAR, 0))
+        elif kind < 0.97:
+            packet = builder.build(dosa.Messages.LOG, struct.pack("<B", dosa.LogLevel.INFO) + b"Calibrated sensor")
+        else:
+            packet = builder.build(dosa.Messages.SEC, struct.pack("<B", dosa.SecurityLevel.ALERT))
+
+        traffic.append((bytes(packet), addr))
+        if rnd.random() < retry_share:
+            traffic.append((bytes(packet), addr))
+
+    return traffic[:count]
+
+
+def measure(fn, items, repeat=3):
+    """
+    Best-of-`repeat` throughput of calling fn(item) for every item, in items per second.
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for item in items:
+            fn(item)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return len(items) / best
+
+
+def result(ops_per_sec, **extra):
+    """
+    A result record, with the CPU share each target rate would take at the measured throughput.
+    """
+    record = {"ops_per_sec": round(ops_per_sec)}
+    record["utilisation"] = {str(rate): round(rate / ops_per_sec, 3) for rate in TARGET_RATES}
+    record.update(extra)
+    return record
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Runs the benchmark suite offline and records the results as JSON.
+
+    python3 benchmarks/run.py                                  # results to benchmarks/results/<host>-<time>.json
+    python3 benchmarks/run.py --compare benchmarks/results/baseline.json
+
+Each result is the best throughput in operations per second, plus the CPU share that 1k-50k packets/s would take at
+that throughput; a share over 1.0 means that rate would be dropped. With --compare, results more than --threshold
+slower than the baseline are reported and the exit code is non-zero.
+"""
+
+import argparse
+import json
+import os
+import platform
+import socket
+import sys
+import time
+
+import bench_comms
+import bench_dispatch
+import common
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def run(fleet_sizes):
+    results = {}
+    results.update(bench_comms.run(fleet_sizes))
+    results.update(bench_dispatch.run(fleet_sizes))
+
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime()),
+        "host": socket.gethostname(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+
+
+def compare(report, baseline, threshold):
+    """
+    Print the change against a baseline report, returns the names of results that regressed.
+    """
+    regressions = []
+
+    for name, record in report["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+
+        change = record["ops_per_sec"] / base["ops_per_sec"] - 1
+        flag = ""
+        if change < -threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+
+        print(name.ljust(40) + str(base["ops_per_sec"]).rjust(12) + str(record["ops_per_sec"]).rjust(12) +
+              (("+" if change >= 0 else "") + str(round(change * 100, 1)) + "%").rjust(10) + flag)
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='DOSA benchmark suite')
+    parser.add_argument('-o', '--output', dest='output', action='store', help='results file')
+    parser.add_argument('-c', '--compare', dest='compare', action='store', help='baseline results file')
+    parser.add_argument('-t', '--threshold', dest='threshold', action='store', type=float, default=0.2,
+                        help='slow-down against the baseline that counts as a regression (default 0.2)')
+    parser.add_argument('-f', '--fleet', dest='fleet', action='store', type=int, nargs='+',
+                        default=list(common.FLEET_SIZES), help='fleet sizes')
+    args = parser.parse_args()
+
+    report = run(args.fleet)
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, report["host"] + "-" + time.strftime("%Y%m%d-%H%M%S") + ".json")
+
+    with open(output, "w") as file:
+        json.dump(report, file, indent=2)
+
+    for name, record in report["results"].items():
+        worst = max((rate for rate, share in record["utilisation"].items() if share <= 1.0), key=int, default="-")
+        print(name.ljust(40) + str(record["ops_per_sec"]).rjust(12) + " /s   sustains " + worst + "/s")
+
+    print("Results written to " + output)
+
+    if args.compare:
+        with open(args.compare, "r") as file:
+            baseline = json.load(file)
+
+        print()
+        print("vs " + args.compare)
+        if compare(report, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,24 +7,71 @@ import daemon.pidfile
 
 import dosa
 from dosa.secbot import SecBot
+from dosa.tts import TtsCache
 
 DEVICE_NAME = b"DOSA Security Bot"
 
 
-def run_app(voice, engine):
+def run_app(voice, engine, interfaces=None, ipv6_group=None):
     first_run = True
     while True:
+        comms = None
+        secbot = None
         try:
-            comms = dosa.Comms(DEVICE_NAME)
+            comms = dosa.Comms(DEVICE_NAME, interfaces=interfaces, ipv6_group=ipv6_group)
             secbot = SecBot(comms, voice=voice, engine=engine)
             secbot.run(announce=first_run)
         except Exception as e:
             # Most commonly this will be a network error (OSError or boto error)
             print("Fault: " + str(e))
             first_run = False
+
+            # Release sockets and worker threads before starting over
+            if secbot is not None:
+                secbot.stop()
+            elif comms is not None:
+                comms.close()
+
             time.sleep(1)
 
 
+def run_tts_cache(action, voice, engine):
+    """
+    TTS cache maintenance, returns a process exit code.
+
+    Pruning and verifying only touch the cache files, so are safe beside a running SecBot; populating needs Polly.
+    """
+    if action == "prune":
+        cache = open_tts_cache()
+        evicted = cache.prune()
+        print("Pruned " + str(len(evicted)) + " files, " + str(len(cache.entries)) + " remain (" +
+              str(round(cache.size() / 1024 / 1024, 1)) + " MB)")
+        return 0
+
+    elif action == "verify":
+        cache = open_tts_cache()
+        removed = cache.verify()
+        for msg_hash, reason in removed:
+            print("Removed " + msg_hash + ": " + reason)
+        print("Verified " + str(len(cache.entries)) + " files, removed " + str(len(removed)))
+        return 1 if removed else 0
+
+    comms = dosa.Comms(DEVICE_NAME)
+    secbot = SecBot(comms, voice=voice, engine=engine)
+
+    try:
+        failed = secbot.populate_tts_cache()
+        print("Cache holds " + str(len(secbot.tts.cache.entries)) + " files, " + str(failed) + " failed")
+        return 1 if failed else 0
+    finally:
+        secbot.stop()
+
+
+def open_tts_cache():
+    max_bytes, max_age = SecBot.get_tts_cache_limits(dosa.get_config())
+    return TtsCache(TtsCache.PATH, max_bytes=max_bytes, max_age=max_age)
+
+
 if __name__ == "__main__":
     # Arg parser
     parser = argparse.ArgumentParser(description='DOSA Security Bot')
@@ -36,15 +83,26 @@ if __name__ == "__main__":
                         help='bot voice (Emma, Amy, Brian)')
     parser.add_argument('-e', '--engine', dest='engine', action='store', default="neural",
                         help='TTS engine (neural, standard)')
+    parser.add_argument('-i', '--interface', dest='interfaces', action='append', default=[],
+                        help='supervise the segment on this interface (name or IPv4 address), may be repeated')
+    parser.add_argument('--ipv6', dest='ipv6', nargs='?', const=dosa.Comms.MULTICAST_GROUP_V6, action='store',
+                        help='also use an IPv6 multicast group (default ' + dosa.Comms.MULTICAST_GROUP_V6 +
+                             '), needs interfaces given by name')
+
+    parser.add_argument('--tts-cache', dest='tts_cache', action='store', choices=["prune", "verify", "populate"],
+                        help='TTS cache maintenance, then exit')
 
     args = parser.parse_args()
 
+    if args.tts_cache:
+        sys.exit(run_tts_cache(args.tts_cache, args.voice, args.engine))
+
     if args.daemon:
         with daemon.DaemonContext(pidfile=daemon.pidfile.TimeoutPIDLockFile(args.pid) if args.pid else None):
-            run_app(args.voice, args.engine)
+            run_app(args.voice, args.engine, args.interfaces, args.ipv6)
     else:
         try:
-            run_app(args.voice, args.engine)
+            run_app(args.voice, args.engine, args.interfaces, args.ipv6)
         except KeyboardInterrupt:
             print("")
             sys.exit(0)
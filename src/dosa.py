@@ -2,12 +2,45 @@
 
 import argparse
 import sys
+import time
 
 import dosa
+import dosa.sim
 
 DEVICE_NAME = b"DOSA Network Tools"
 
 
+def run_sim(args):
+    """
+    Run a simulated fleet or replay a capture, alongside the program under test on this host.
+
+    Simulated devices bind the DOSA port on their own loopback addresses, and the multicast group to answer pings.
+    Replayed packets are sent from loopback addresses on the ports they were captured from.
+    """
+    try:
+        if args.replay:
+            replayer = dosa.sim.Replayer(speed=args.speed)
+            pps = replayer.replay(args.replay)
+            print("Replayed " + str(replayer.sent) + " packets in " + str(round(replayer.elapsed, 2)) + "s (" +
+                  str(round(pps)) + " pps)")
+            return
+
+        fleet = dosa.sim.SimFleet(count=args.sim)
+        fleet.start()
+        print("Simulating " + str(args.sim) + " devices from " + fleet.devices[0].address[0] + ", Ctrl+C to stop")
+        try:
+            end = None if args.duration is None else time.monotonic() + args.duration
+            while end is None or time.monotonic() < end:
+                time.sleep(0.5)
+        finally:
+            fleet.stop()
+            print("Sent " + str(fleet.sent) + ", received " + str(fleet.received) + ", retransmits " +
+                  str(fleet.retransmits))
+
+    except KeyboardInterrupt:
+        print("")
+
+
 def cli():
     parser = argparse.ArgumentParser(description='DOSA Network Tools')
 
@@ -27,9 +60,57 @@ def cli():
     parser.add_argument('-f', '--flush', dest='flush', default=False, nargs='?', action='store',
                         help='send a network flush command; target optional')
 
+    # Ping
+    parser.add_argument('-P', '--ping', dest='ping', default=False, nargs='*', action='store',
+                        help='ping devices and report latency and loss; targets optional, else all devices')
+    parser.add_argument('-n', '--count', dest='count', action='store', type=int, default=3,
+                        help='ping rounds')
+
     # Network monitor
     parser.add_argument('-m', '--monitor', dest='monitor', action='store_const', const=True, default=False,
                         help='run a network monitor')
+    parser.add_argument('--plugin', dest='plugins', action='append', default=[],
+                        help='module with extra monitor handlers; may be repeated')
+
+    # Device scan
+    parser.add_argument('-s', '--scan', dest='scan', action='store_const', const=True, default=False,
+                        help='list devices as they answer a ping')
+    parser.add_argument('--subnet', dest='subnet', action='store',
+                        help='also ping every host in a subnet (eg 192.168.1.0/24) when scanning or configuring')
+
+    # Bulk configuration
+    parser.add_argument('--set', dest='set', nargs='+', metavar=('SETTING', 'VALUE'),
+                        help='send a setting to every selected device (' + ", ".join(dosa.legacy.SETTINGS) + ')')
+    parser.add_argument('-D', '--devices', dest='devices', action='store', default="*",
+                        help='devices for --set: names (wildcards allowed), IPs, type:<type> or *; comma separated')
+    parser.add_argument('--fan-out', dest='fan_out', action='store', type=int, default=16,
+                        help='max devices to configure at once')
+
+    # Declarative fleet configuration
+    parser.add_argument('-a', '--apply', dest='apply', action='store',
+                        help='bring devices in line with a fleet file, sending only settings that have changed')
+    parser.add_argument('--dry-run', dest='dry_run', action='store_const', const=True, default=False,
+                        help='with --apply, list the settings that would be sent')
+    parser.add_argument('--force', dest='force', action='store_const', const=True, default=False,
+                        help='with --apply, send every setting even if unchanged')
+
+    # Simulation and capture
+    parser.add_argument('--sim', dest='sim', action='store', type=int,
+                        help='simulate a fleet of N devices on loopback')
+    parser.add_argument('--record', dest='record', action='store',
+                        help='record network traffic to a capture file, including IPv6 with --ipv6')
+    parser.add_argument('--replay', dest='replay', action='store', help='replay a capture file to 127.0.0.1')
+    parser.add_argument('--speed', dest='speed', action='store', type=float, default=1.0,
+                        help='replay speed multiplier, 0 to replay as fast as possible')
+    parser.add_argument('--duration', dest='duration', action='store', type=float,
+                        help='seconds to simulate or record for')
+
+    # Network
+    parser.add_argument('-i', '--interface', dest='interfaces', action='append', default=[],
+                        help='join the multicast group on this interface (name or IPv4 address), may be repeated')
+    parser.add_argument('--ipv6', dest='ipv6', nargs='?', const=dosa.Comms.MULTICAST_GROUP_V6, action='store',
+                        help='also use an IPv6 multicast group (default ' + dosa.Comms.MULTICAST_GROUP_V6 +
+                             '), needs interfaces given by name')
 
     # Legacy config tool
     parser.add_argument('-c', '--config', dest='config', action='store_const', const=True, default=False,
@@ -37,8 +118,12 @@ def cli():
 
     args = parser.parse_args()
 
+    if args.sim is not None or args.replay:
+        run_sim(args)
+        return
+
     # Main app
-    comms = dosa.Comms(DEVICE_NAME)
+    comms = dosa.Comms(DEVICE_NAME, interfaces=args.interfaces, ipv6_group=args.ipv6)
 
     try:
         if args.play:
@@ -66,13 +151,94 @@ def cli():
             else:
                 flush.dispatch()
 
+        elif args.ping is not False:
+            ping = dosa.Ping(comms=comms)
+            try:
+                ok = ping.run(args.ping or None, count=args.count)
+            except dosa.DosaException as e:
+                print(str(e))
+                sys.exit(2)
+
+            if not ok:
+                sys.exit(1)
+
         elif args.monitor is not False:
-            monitor = dosa.Monitor(comms=comms)
+            monitor = dosa.Monitor(comms=comms, plugins=args.plugins)
             monitor.run()
 
+        elif args.scan is not False:
+            scanner = dosa.Scanner(comms=comms)
+            found = 0
+            for d in scanner.scan(args.subnet):
+                found += 1
+                print(d.device_name.ljust(22) + d.address[0].ljust(18) +
+                      dosa.DeviceType.as_string(d.device_type).upper().ljust(20) +
+                      dosa.DeviceStatus.as_string(d.device_state))
+
+            print(str(found) + " devices found in " + str(round(scanner.elapsed, 2)) + "s")
+
+        elif args.set:
+            if args.set[0] not in dosa.legacy.SETTINGS:
+                print("Unknown setting: " + args.set[0])
+                sys.exit(2)
+
+            try:
+                aux = dosa.legacy.SETTINGS[args.set[0]](args.set[1:])
+            except ValueError as e:
+                print(str(e))
+                sys.exit(2)
+
+            fleet = dosa.Fleet(comms=comms, fan_out=args.fan_out)
+            fleet.scan(args.subnet)
+            devices = fleet.select(args.devices)
+            if not devices:
+                print("No devices matched " + args.devices)
+                sys.exit(1)
+
+            if fleet.print_results(fleet.apply(devices, aux)):
+                sys.exit(1)
+
+        elif args.apply:
+            try:
+                spec = dosa.Fleet.load_spec(args.apply)
+            except (OSError, ValueError, dosa.DosaException) as e:
+                print("Bad fleet file: " + str(e))
+                sys.exit(2)
+
+            state = dosa.FleetState()
+            fleet = dosa.Fleet(comms=comms, fan_out=args.fan_out)
+            fleet.scan(args.subnet)
+
+            # Every setting is packed before anything is sent, so a bad value fails the whole run
+            try:
+                if args.dry_run:
+                    for setting, aux, devices in fleet.plan(spec, None if args.force else state):
+                        print(setting.ljust(10) + ", ".join(d.device_name for d in devices))
+                    return
+
+                applied = fleet.apply_spec(spec, state, force=args.force)
+            except ValueError as e:
+                print(str(e))
+                sys.exit(2)
+
+            failed = 0
+            for setting, results in applied:
+                print("-- " + setting + " --")
+                failed += fleet.print_results(results)
+
+            if failed:
+                sys.exit(1)
+
+        elif args.record:
+            recorder = dosa.sim.Recorder(comms=comms)
+            try:
+                recorder.record(args.record, duration=args.duration)
+            finally:
+                print("Recorded " + str(recorder.recorded) + " packets")
+
         elif args.config is not False:
             cfg = dosa.Config(comms=comms)
-            cfg.run()
+            cfg.run(subnet=args.subnet)
 
         else:
             # New configuration tool
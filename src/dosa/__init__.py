@@ -1,9 +1,14 @@
+import collections
 import pathlib
 import json
+import time
 
 from dosa.exc import *
-from dosa.comms import Messages, Message, Comms
+from dosa.comms import Messages, Message, Comms, AsyncComms, RetransmitPolicy, HandlerRegistry, register_payload
+from dosa.payload import TriggerType, Payload, TriggerPayload
 from dosa.legacy import Config
+from dosa.scan import Scanner
+from dosa.fleet import Fleet, FleetState
 from dosa.cfg import GuiConfig
 from dosa.monitor import Monitor
 from dosa.ping import Ping
@@ -11,7 +16,7 @@ from dosa.trigger import Trigger
 from dosa.ota import Ota
 from dosa.flush import Flush
 from dosa.play import Play
-from dosa.device import DeviceType, DeviceStatus, Device
+from dosa.device import DeviceType, DeviceStatus, Device, DeviceRegistry
 
 
 class LogLevel:
@@ -86,32 +91,59 @@ class AlertCategory:
 
 
 class MessageLog:
-    def __init__(self, max_history=25):
-        self.history = []
+    """
+    Duplicate suppression for received messages.
+
+    Remembers each (address, msg_id) pair for up to `ttl` seconds, holding at most `max_history` pairs with the oldest
+    evicted first. Lookup and insert are O(1).
+    """
+
+    def __init__(self, max_history=1024, ttl=30.0):
+        self.history = collections.OrderedDict()
         self.max_history = max_history
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
 
     def validate(self, dvc, msg_id):
-        if self.is_registered(dvc, msg_id):
-            return True
-        else:
-            self.add_device(dvc, msg_id)
-            return False
+        return self.check(dvc.address, msg_id)
 
-    def is_registered(self, dvc, msg_id):
-        for d, m in self.history:
-            if dvc.address == d.address and m == msg_id:
-                return True
+    def check(self, address, msg_id):
+        """
+        Returns True if this message has been seen before, else registers it and returns False.
+        """
+        now = time.monotonic()
+        seen = self.history.get((address, msg_id))
 
+        if seen is not None and now - seen <= self.ttl:
+            self.hits += 1
+            return True
+
+        self.misses += 1
+        self.add(address, msg_id, now)
         return False
 
+    def is_registered(self, dvc, msg_id):
+        seen = self.history.get((dvc.address, msg_id))
+        return seen is not None and time.monotonic() - seen <= self.ttl
+
     def add_device(self, dvc, msg_id):
-        if dvc.address is None:
+        self.add(dvc.address, msg_id, time.monotonic())
+
+    def add(self, address, msg_id, now):
+        if address is None:
             return
 
-        if len(self.history) == self.max_history:
-            self.history.pop(0)
+        key = (address, msg_id)
+        self.history[key] = now
+        self.history.move_to_end(key)
+
+        # Entries are kept in insertion order, so both limits evict from the front
+        while len(self.history) > self.max_history:
+            self.history.popitem(last=False)
 
-        self.history.append((dvc, msg_id))
+        while now - next(iter(self.history.values())) > self.ttl:
+            self.history.popitem(last=False)
 
 
 def get_config_file():
@@ -0,0 +1,175 @@
+import json
+import queue
+import threading
+import time
+
+import dosa
+from dosa.metrics import NULL as NULL_METRICS
+from botocore.exceptions import BotoCoreError, ClientError
+
+
+class AlertJob:
+    def __init__(self, arn, device, category, msg, attributes):
+        self.arn = arn
+        self.device = device
+        self.category = category
+        self.msg = msg
+        self.attributes = attributes
+
+
+class AlertDispatcher:
+    """
+    Publishes alerts to SNS from a pool of worker threads, so that slow or failing AWS calls never hold up packet
+    handling.
+
+    Each end-point ARN is published to as its own job, with its own retries and exponential backoff. Repeats of an
+    alert for the same device, category and level within `coalesce_window` seconds are folded into the next alert
+    that is sent, which carries a "suppressed" count; flush() sends that as a summary once the window expires.
+    """
+
+    def __init__(self, sns, comms=None, workers=4, max_queue=256, retries=3, backoff=0.5, coalesce_window=60):
+        self.sns = sns
+        self.comms = comms
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.coalesce_window = coalesce_window
+
+        self.queue = queue.Queue(max_queue)
+        self.threads = []
+        self.lock = threading.Lock()
+        self.last_sent = {}
+        self.suppressed = {}
+
+        # Key -> (msg, arns, tags) of the latest suppressed alert, for the summary
+        self.held = {}
+
+        self.published = 0
+        self.failed = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.metrics = NULL_METRICS
+
+    def submit(self, device, msg, category, arns, tags, level=None):
+        """
+        Queue an alert for publishing to every ARN in `arns`.
+
+        Alerts are coalesced per level, so a more severe alert is never held back by a lesser one before it. Returns
+        False if the alert was coalesced into an earlier one or the queue is full.
+        """
+        key = (device, category, level)
+        now = time.monotonic()
+
+        with self.lock:
+            last = self.last_sent.get(key)
+            if last is not None and now - last < self.coalesce_window:
+                self.suppressed[key] = self.suppressed.get(key, 0) + 1
+                self.held[key] = (msg, arns, tags)
+                self.coalesced += 1
+                return False
+
+            if not self.threads:
+                self.start()
+
+            return self.enqueue(key, msg, arns, tags, now)
+
+    def flush(self):
+        """
+        Send a summary of every alert whose coalescing window has expired with repeats suppressed, so they are
+        reported even if the alert doesn't recur.
+        """
+        now = time.monotonic()
+
+        with self.lock:
+            for key in [k for k in self.suppressed if now - self.last_sent[k] >= self.coalesce_window]:
+                msg, arns, tags = self.held[key]
+                tags = dict(tags)
+                tags["summary"] = "true"
+                self.enqueue(key, msg, arns, tags, now)
+
+    def enqueue(self, key, msg, arns, tags, now):
+        """
+        Queue a job per ARN, the alert only counts as sent once every job is queued. Must hold the lock.
+        """
+        device, category, _ = key
+
+        suppressed = self.suppressed.get(key, 0)
+        if suppressed:
+            tags = dict(tags)
+            tags["suppressed"] = str(suppressed)
+
+        attributes = {}
+        for name, value in tags.items():
+            attributes[name] = {"DataType": "String", "StringValue": value}
+
+        for arn in arns:
+            try:
+                self.queue.put_nowait(AlertJob(arn, device, category, msg, attributes))
+            except queue.Full:
+                self.dropped += 1
+                self.net_log(dosa.LogLevel.ERROR, "SecBot alert queue full, dropped alert for device " + device)
+                return False
+
+        self.last_sent[key] = now
+        self.suppressed.pop(key, None)
+        self.held.pop(key, None)
+        return True
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self.run_worker, name="alerts-" + str(i), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        """
+        Stop the workers once queued alerts have been published.
+        """
+        for _ in self.threads:
+            self.queue.put(None)
+
+        for thread in self.threads:
+            thread.join()
+
+        self.threads = []
+
+    def run_worker(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+
+            self.publish(job)
+
+    def publish(self, job):
+        for attempt in range(self.retries + 1):
+            try:
+                with self.metrics.histogram("sns_publish_seconds", "Time to publish an alert to SNS").time():
+                    self.sns.publish(
+                        TargetArn=job.arn,
+                        Message=json.dumps({'default': job.msg}),
+                        MessageStructure='json',
+                        MessageAttributes=job.attributes,
+                    )
+            except (BotoCoreError, ClientError):
+                self.metrics.counter("sns_publish_errors_total", "SNS publish attempts that failed").inc()
+                if attempt < self.retries:
+                    time.sleep(self.backoff * (2 ** attempt))
+                continue
+
+            with self.lock:
+                self.published += 1
+
+            print(job.category + " alert dispatched to " + job.arn)
+            self.net_log(dosa.LogLevel.WARNING, job.category + " alert dispatched to " + job.arn)
+            return True
+
+        with self.lock:
+            self.failed += 1
+
+        self.net_log(dosa.LogLevel.ERROR, "SecBot failed to sent alert for device " + job.device)
+        return False
+
+    def net_log(self, level, msg):
+        if self.comms is not None:
+            self.comms.net_log(level, msg)
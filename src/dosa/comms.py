@@ -1,8 +1,28 @@
+import asyncio
+import collections
+import importlib
+import ipaddress
+import os
+import random
+import selectors
 import socket
 import secrets
 import time
 import struct
+import sys
+import threading
 from dosa.exc import *
+from dosa.metrics import NULL as NULL_METRICS
+from dosa.payload import *
+
+# Message ID, message code, packet size, device name
+HEADER = struct.Struct("<H3sH20s")
+
+# Linux socket options the socket module doesn't export
+SO_RCVBUFFORCE = getattr(socket, "SO_RCVBUFFORCE", 33 if sys.platform.startswith("linux") else None)
+SO_RXQ_OVFL = getattr(socket, "SO_RXQ_OVFL", 40 if sys.platform.startswith("linux") else None)
+IP_MULTICAST_ALL = getattr(socket, "IP_MULTICAST_ALL", 49 if sys.platform.startswith("linux") else None)
+IPV6_MULTICAST_ALL = getattr(socket, "IPV6_MULTICAST_ALL", 29 if sys.platform.startswith("linux") else None)
 
 
 class Messages:
@@ -27,124 +47,799 @@ class Messages:
 
 
 class Message:
+    """
+    A received DOSA packet.
+
+    Header fields are unpacked together on first access, the device name is decoded on first access and `body` gives
+    a typed view of the auxiliary data per message code.
+    """
+    __slots__ = ("payload", "addr", "_header", "_device_name", "_body")
+
     def __init__(self, packet, addr):
         if len(packet) < Comms.BASE_PAYLOAD_SIZE:
             raise NotDosaPacketException("Not a valid DOSA message")
 
         self.payload = packet
         self.addr = addr
+        self._header = None
+        self._device_name = None
+        self._body = None
+
+    @property
+    def header(self):
+        if self._header is None:
+            self._header = HEADER.unpack_from(self.payload)
+
+        return self._header
+
+    @property
+    def msg_id(self):
+        return self.header[0]
+
+    @property
+    def msg_code(self):
+        return self.header[1]
+
+    @property
+    def payload_size(self):
+        return self.header[2]
 
-        self.msg_id = struct.unpack("<H", packet[0:2])[0]
-        self.msg_code = packet[2:5]
-        self.payload_size = struct.unpack("<H", packet[5:7])[0]
-        self.device_name = packet[7:25].decode("utf-8").rstrip('\x00')
+    @property
+    def device_name(self):
+        if self._device_name is None:
+            self._device_name = self.header[3].split(b'\0', 1)[0].decode("utf-8", errors="replace")
+
+        return self._device_name
+
+    @property
+    def body(self):
+        """
+        Typed view of the auxiliary data, a plain Payload for message codes without a dedicated type.
+        """
+        if self._body is None:
+            self._body = PAYLOAD_TYPES.get(self.msg_code, Payload).decode(self)
+
+        return self._body
 
     def msg_id_bytes(self):
         return self.payload[0:2]
 
 
-class Comms:
+# Payload view per message code, see Message.body
+PAYLOAD_TYPES = {
+    Messages.ACK: AckPayload,
+    Messages.LOG: LogPayload,
+    Messages.SEC: SecPayload,
+    Messages.TRIGGER: TriggerPayload,
+    Messages.PONG: PongPayload,
+    Messages.PLAY: PlayPayload,
+}
+
+
+def register_payload(code, payload_type):
+    """
+    Set the payload view that Message.body decodes a message code with.
+    """
+    PAYLOAD_TYPES[code] = payload_type
+
+
+class HandlerRegistry:
+    """
+    Message handlers by message code, dispatch is a single dict lookup.
+
+    Handlers are called in the order registered, with the message and any extra arguments given to dispatch(). Messages
+    with no registered handlers go to the default handler, codes registered with ignore() go nowhere.
+
+    Plugins are modules with a `register(registry, owner)` function, which may register handlers and payload views for
+    new message codes or trigger types.
+    """
+
+    def __init__(self, default=None):
+        self.handlers = {}
+        self.default = default
+
+    def register(self, code, handler, decoder=None):
+        if decoder is not None:
+            register_payload(code, decoder)
+
+        self.handlers.setdefault(code, []).append(handler)
+
+    def unregister(self, code, handler):
+        handlers = self.handlers.get(code)
+        if handlers is not None and handler in handlers:
+            handlers.remove(handler)
+
+    def ignore(self, code):
+        self.handlers.setdefault(code, [])
+
+    def handles(self, code):
+        return code in self.handlers
+
+    def dispatch(self, msg, *args):
+        """
+        Pass a message to its handlers, returning a list of their results.
+        """
+        handlers = self.handlers.get(msg.msg_code)
+        if handlers is None:
+            return [] if self.default is None else [self.default(msg, *args)]
+
+        return [handler(msg, *args) for handler in handlers]
+
+    def load_plugins(self, modules, owner=None):
+        for name in modules:
+            importlib.import_module(name).register(self, owner)
+
+
+class PacketBuilder:
+    """
+    Packs DOSA packets for a single sender.
+
+    The 27-byte header (message ID, code, size and null-padded device name) is packed with one precompiled struct,
+    straight into the destination buffer.
+    """
+    HEADER = HEADER
+
+    def __init__(self, device_name):
+        if len(device_name) > 20:
+            raise CommsException("Device name cannot exceed 20 bytes")
+
+        self.device_name = bytes(device_name)
+
+    def build(self, cmd, aux_data=b''):
+        """
+        Build a payload with a random message ID into a new bytearray.
+        """
+        size = self.HEADER.size + len(aux_data)
+        payload = bytearray(size)
+        self.HEADER.pack_into(payload, 0, secrets.randbits(16), cmd, size, self.device_name)
+        payload[self.HEADER.size:] = aux_data
+        return payload
+
+
+class RetransmitPolicy:
+    """
+    Retransmission schedule for messages awaiting an ACK.
+
+    The first retransmit follows `initial_rto` seconds after the first send, or the adaptive RTO for the target once
+    ACK round trips have been measured. Each following interval is multiplied by `backoff`, capped at `max_rto`, and
+    varied randomly by +/- `jitter` (as a fraction) so that senders don't fall into step. No more than `max_attempts`
+    transmissions are made in total.
+    """
+
+    def __init__(self, initial_rto=0.2, backoff=2.0, max_attempts=6, jitter=0.1, min_rto=0.05, max_rto=2.0,
+                 adaptive=True):
+        self.initial_rto = initial_rto
+        self.backoff = backoff
+        self.max_attempts = max_attempts
+        self.jitter = jitter
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.adaptive = adaptive
+
+    def interval(self, attempts, rto=None):
+        """
+        Seconds to wait after transmission number `attempts` before sending again, or None if out of attempts.
+        """
+        if attempts >= self.max_attempts:
+            return None
+
+        if rto is None or not self.adaptive:
+            rto = self.initial_rto
+
+        interval = min(rto * (self.backoff ** (attempts - 1)), self.max_rto)
+        if self.jitter:
+            interval *= 1 + random.uniform(-self.jitter, self.jitter)
+
+        return interval
+
+
+class RttEstimator:
+    """
+    Smoothed ACK round-trip time for a single target, per RFC 6298.
+    """
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+
+    def __init__(self, min_rto=0.05, max_rto=2.0):
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.srtt = None
+        self.rttvar = None
+        self.samples = 0
+
+    def sample(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - self.BETA) * self.rttvar + self.BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * rtt
+
+        self.samples += 1
+
+    @property
+    def rto(self):
+        if self.srtt is None:
+            return None
+
+        return min(max(self.srtt + 4 * self.rttvar, self.min_rto), self.max_rto)
+
+
+class PendingAck:
+    """
+    A sent message awaiting an ACK.
+
+    Only an ACK from the target completes it. Sent to a multicast group it is completed by the first ACK from any
+    device, and every device that ACKs is recorded in `responders`.
+    """
+
+    def __init__(self, payload, tgt, policy):
+        self.payload = payload
+        self.tgt = tgt
+        self.policy = policy
+        self.multicast = self.is_multicast(tgt[0])
+        self.responders = {}
+        self.msg_id = struct.unpack("<H", payload[0:2])[0]
+        self.sent_at = time.monotonic()
+        self.last_sent = self.sent_at
+        self.next_send = None
+        self.acked_at = None
+        self.ack = None
+        self.attempts = 1
+
+    @property
+    def acked(self):
+        return self.acked_at is not None
+
+    @property
+    def latency(self):
+        """
+        Seconds between the first transmission and the ACK, or None if not (yet) ack'd.
+        """
+        if self.acked_at is None:
+            return None
+
+        return self.acked_at - self.sent_at
+
+    def matches(self, addr):
+        """
+        If an ACK from `addr` answers this message.
+        """
+        return self.multicast or addr[0] == self.tgt[0]
+
+    @staticmethod
+    def is_multicast(host):
+        try:
+            return ipaddress.ip_address(host).is_multicast
+        except ValueError:
+            return False
+
+
+class AckTable:
+    """
+    Registry of messages awaiting an ACK, keyed by message ID and matched against the address an ACK came from.
+
+    Every ACK received is offered to the table, so any number of ACK waits may overlap. Waiters on other threads are
+    woken through `cond` whenever an ACK completes a request.
+    """
+
+    def __init__(self, history=100):
+        self.pending = {}
+        self.cond = threading.Condition()
+
+        # (msg_id, address, latency) for the most recently ack'd messages
+        self.latencies = collections.deque(maxlen=history)
+
+    def register(self, pending):
+        with self.cond:
+            self.pending.setdefault(pending.msg_id, []).append(pending)
+
+    def discard(self, pending):
+        with self.cond:
+            waiters = self.pending.get(pending.msg_id)
+            if waiters is None or pending not in waiters:
+                return
+
+            waiters.remove(pending)
+            if not waiters:
+                del self.pending[pending.msg_id]
+
+    def resolve(self, msg):
+        """
+        Match an ACK message against outstanding requests.
+
+        Returns a list of the requests the ACK completed.
+        """
+        ack_id = msg.body.ack_id if msg.msg_code == Messages.ACK else None
+        if ack_id is None:
+            return []
+
+        completed = []
+        with self.cond:
+            for pending in self.pending.get(ack_id, ()):
+                if not pending.matches(msg.addr) or msg.addr in pending.responders:
+                    continue
+
+                now = time.monotonic()
+                pending.responders[msg.addr] = now
+                self.latencies.append((pending.msg_id, msg.addr, now - pending.sent_at))
+
+                if pending.acked:
+                    continue
+
+                pending.acked_at = now
+                pending.ack = msg
+                completed.append(pending)
+
+            if completed:
+                self.cond.notify_all()
+
+        return completed
+
+    def wait(self, pending, timeout):
+        """
+        Sleep until an ACK completes a request or the timeout expires, unless everything in `pending` is already ack'd.
+        """
+        with self.cond:
+            if any(not p.acked for p in pending):
+                self.cond.wait(timeout)
+
+
+class Listener:
+    """
+    A socket joined to a DOSA multicast group on one interface, which also sends multicast out of that interface.
+
+    `interface` is an interface name, or for IPv4 the address of an interface. None joins the group on whichever
+    interface the kernel picks, which for a link-local IPv6 group (ff02::) is not allowed.
+    """
+
+    def __init__(self, group, port, interface=None, hops=32):
+        self.group = group
+        self.interface = interface
+        self.family = socket.AF_INET6 if ":" in group else socket.AF_INET
+
+        self.sock = socket.socket(self.family, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+        try:
+            if self.family == socket.AF_INET6:
+                self.join_v6(port, hops)
+            else:
+                self.join_v4(port, hops)
+        except Exception:
+            self.sock.close()
+            raise
+
+    def join_v4(self, port, hops):
+        self.target = (self.group, port)
+        self.sock.bind(self.target)
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, hops)
+
+        group = socket.inet_aton(self.group)
+        if self.interface is None:
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                                 struct.pack("4sl", group, socket.INADDR_ANY))
+            return
+
+        # An address selects the interface directly, a name is resolved to its index with the Linux ip_mreqn form
+        try:
+            iface = socket.inet_aton(self.interface)
+            mreq = group + iface
+        except OSError:
+            iface = mreq = struct.pack("4s4si", group, bytes(4), self.get_index())
+
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, iface)
+
+        # Only deliver the group as joined on this interface, so each listener sees its own segment
+        if IP_MULTICAST_ALL is not None:
+            self.sock.setsockopt(socket.IPPROTO_IP, IP_MULTICAST_ALL, 0)
+
+    def join_v6(self, port, hops):
+        # Scope is the low nibble of the second byte, 2 being link-local
+        if self.interface is None and socket.inet_pton(socket.AF_INET6, self.group)[1] & 0x0f == 2:
+            raise CommsException("Link-local group " + self.group + " needs an interface")
+
+        index = 0 if self.interface is None else self.get_index()
+
+        self.target = (self.group, port, 0, index)
+        self.sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 1)
+        self.sock.bind(self.target)
+        self.sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_MULTICAST_HOPS, hops)
+        self.sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_JOIN_GROUP,
+                             socket.inet_pton(socket.AF_INET6, self.group) + struct.pack("@I", index))
+
+        if index:
+            self.sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_MULTICAST_IF, index)
+            if IPV6_MULTICAST_ALL is not None:
+                self.sock.setsockopt(socket.IPPROTO_IPV6, IPV6_MULTICAST_ALL, 0)
+
+    def get_index(self):
+        try:
+            return socket.if_nametoindex(self.interface)
+        except OSError:
+            raise CommsException("Unknown network interface: " + str(self.interface))
+
+    def close(self):
+        self.sock.close()
+
+
+class BaseComms:
+    """
+    Socket setup and packet building shared by the blocking and asyncio transports.
+    """
     BASE_PAYLOAD_SIZE = 27
     MULTICAST_GROUP = '239.1.1.69'
+    MULTICAST_GROUP_V6 = 'ff02::239:1:1:69'
     MULTICAST_PORT = 6901
     MULTICAST_MAX_HOPS = 32
 
-    def __init__(self, device_name=b"Python Script"):
+    # Number of recent datagrams remembered when suppressing copies delivered to more than one socket
+    COPY_HISTORY = 64
+
+    # Per-socket UDP statistics, including datagrams dropped on a full receive buffer
+    PROC_NET_UDP = ("/proc/net/udp", "/proc/net/udp6")
+
+    def __init__(self, device_name=b"Python Script", retransmit=None, rcvbuf=None, interfaces=None, ipv6_group=None):
+        # Interfaces to join the MC group on, none for whichever the kernel picks
+        self.interfaces = list(interfaces) if interfaces else []
+        self.ipv6_group = ipv6_group
+
         # For binding all IPs on MC port
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
-        self.sock.settimeout(0.01)
 
-        # For binding MC group
-        self.mc_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
-        self.mc_sock.settimeout(0.01)
+        # The same for IPv6, if an IPv6 group is in use
+        self.sock6 = None
 
-        self.device_name = device_name
-
-        if len(device_name) > 20:
-            raise Exception("Device name cannot exceed 20 bytes")
+        # One per interface and MC group
+        self.listeners = []
 
+        self.builder = PacketBuilder(device_name)
         self.bind()
 
+        # Every socket that is read from
+        self.rx_sockets = [self.sock] + ([self.sock6] if self.sock6 is not None else []) + \
+                          [listener.sock for listener in self.listeners]
+
+        # Listener for the IPv4 group on the first interface
+        self.mc_sock = self.listeners[0].sock
+        self._copies = collections.OrderedDict()
+
+        # Effective receive buffer size in bytes, as reported by the kernel
+        self.rcvbuf = None
+        if rcvbuf:
+            self.set_rcvbuf(rcvbuf)
+
+        # Socket -> kernel drop count, where drops are reported with each datagram via SO_RXQ_OVFL
+        self.rxq_ovfl = False
+        self.rx_drops = {}
+
+        # Default retransmit schedule for ACK'd messages, plus measured round-trip times per target
+        self.retransmit = retransmit if retransmit is not None else RetransmitPolicy()
+
+        # Replaced with a dosa.metrics.Metrics registry to record ACK round trips and retransmits
+        self.metrics = NULL_METRICS
+        self.rtt = {}
+
     def bind(self):
         """
         Bind the multicast port.
 
-        This will create a bind to all IPs on the MC port, along with the MC group in two different sockets.
+        This will create a bind to all IPs on the MC port, along with a listener on the MC group for each interface.
+        An IPv6 group adds the same again for IPv6, which needs interfaces given by name.
         """
-        # to receive multicast messages -
-        self.mc_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.mc_sock.bind((self.MULTICAST_GROUP, self.MULTICAST_PORT))
-        self.mc_sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
-                                struct.pack("4sl", socket.inet_aton(self.MULTICAST_GROUP), socket.INADDR_ANY))
+        try:
+            # to receive multicast messages, and send them out of each interface -
+            for interface in self.interfaces or [None]:
+                self.listeners.append(Listener(self.MULTICAST_GROUP, self.MULTICAST_PORT, interface,
+                                               self.MULTICAST_MAX_HOPS))
 
-        # to send messages, and receive direct messages -
-        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, self.MULTICAST_MAX_HOPS)
-        self.sock.bind(('', self.MULTICAST_PORT))
+            # to send messages, and receive direct messages -
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, self.MULTICAST_MAX_HOPS)
+            self.sock.bind(('', self.MULTICAST_PORT))
+
+            if self.ipv6_group:
+                for interface in self.interfaces or [None]:
+                    self.listeners.append(Listener(self.ipv6_group, self.MULTICAST_PORT, interface,
+                                                   self.MULTICAST_MAX_HOPS))
+
+                self.sock6 = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+                self.sock6.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                self.sock6.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 1)
+                self.sock6.bind(('::', self.MULTICAST_PORT))
+        except (OSError, DosaException) as e:
+            # Close whatever was opened before the failure, rather than leaking it with the half-built object
+            for listener in self.listeners:
+                listener.close()
+            self.listeners = []
+
+            self.sock.close()
+            if self.sock6 is not None:
+                self.sock6.close()
+                self.sock6 = None
+
+            if isinstance(e, DosaException):
+                raise
+
+            raise CommsException("Unable to bind the DOSA port: " + str(e)) from e
+
+    def transmit(self, payload, tgt):
+        """
+        Send a payload to a validated target, multicast goes to every group out of every listener's interface.
+        """
+        if tgt == (self.MULTICAST_GROUP, self.MULTICAST_PORT):
+            for listener in self.listeners:
+                self.send_on(listener.sock, payload, listener.target)
+        elif self.sock6 is not None and ":" in tgt[0]:
+            self.send_on(self.sock6, payload, tgt)
+        else:
+            self.send_on(self.sock, payload, tgt)
+
+    def send_on(self, sock, payload, tgt):
+        sock.sendto(payload, tgt)
+
+    def set_rcvbuf(self, size):
+        """
+        Set the kernel receive buffer of every socket, so bursts from many devices queue rather than being dropped.
+
+        Linux caps SO_RCVBUF at net.core.rmem_max unless the process may use SO_RCVBUFFORCE. Returns the effective
+        size, which Linux reports as double the request to allow for its own bookkeeping.
+        """
+        for sock in self.rx_sockets:
+            if SO_RCVBUFFORCE is not None:
+                try:
+                    sock.setsockopt(socket.SOL_SOCKET, SO_RCVBUFFORCE, size)
+                    continue
+                except PermissionError:
+                    pass
+
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, size)
+
+        self.rcvbuf = min(s.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF) for s in self.rx_sockets)
+        return self.rcvbuf
+
+    def kernel_drops(self):
+        """
+        Datagrams the kernel has dropped because a socket's receive buffer was full, summed over every socket.
+
+        Read from /proc/net/udp, or from the SO_RXQ_OVFL counts reported with received datagrams where /proc isn't
+        available. Returns None if neither is.
+        """
+        inodes = {os.fstat(sock.fileno()).st_ino for sock in self.rx_sockets}
+
+        try:
+            drops = 0
+            for path in self.PROC_NET_UDP[:2 if self.sock6 is not None else 1]:
+                with open(path, "r") as file:
+                    next(file)
+                    for line in file:
+                        fields = line.split()
+                        if len(fields) >= 13 and int(fields[9]) in inodes:
+                            drops += int(fields[12])
+
+            return drops
+        except (OSError, ValueError, StopIteration):
+            pass
+
+        if self.rxq_ovfl:
+            return sum(self.rx_drops.values())
+
+        return None
+
+    @property
+    def device_name(self):
+        return self.builder.device_name
+
+    @device_name.setter
+    def device_name(self, device_name):
+        self.builder = PacketBuilder(device_name)
+
+    def get_target(self, tgt):
+        """
+        Validate a message target, a target of None is the multicast group.
+        """
+        if tgt is None:
+            return self.MULTICAST_GROUP, self.MULTICAST_PORT
+        elif type(tgt) is not tuple:
+            raise Exception("Message target must be a tuple")
+
+        return tgt
+
+    def schedule_retransmit(self, pending):
+        """
+        Set the time at which a pending message is next due to be sent, None once it is out of attempts.
+        """
+        estimator = self.rtt.get(pending.tgt)
+        interval = pending.policy.interval(pending.attempts, estimator.rto if estimator else None)
+        pending.next_send = None if interval is None else pending.last_sent + interval
+
+    def record_rtt(self, pending):
+        """
+        Feed the round trip of an ACK'd message into its target's RTO estimate.
+
+        Messages that were retransmitted are skipped, as it is unknown which copy was ACK'd (Karn's algorithm).
+        """
+        if pending.latency is not None:
+            self.metrics.histogram("ack_rtt_seconds", "Time from first send of a message to its ACK").observe(
+                pending.latency)
+
+        if pending.attempts != 1 or pending.latency is None:
+            return
+
+        estimator = self.rtt.get(pending.tgt)
+        if estimator is None:
+            policy = pending.policy
+            estimator = self.rtt[pending.tgt] = RttEstimator(min_rto=policy.min_rto, max_rto=policy.max_rto)
+
+        estimator.sample(pending.latency)
+
+    def is_first_copy(self, source, packet, addr):
+        """
+        Multicast datagrams are delivered to every socket bound to the port, so the same datagram will arrive on both
+        the direct socket and a listener.
+
+        A datagram is passed on when its source socket has now seen it more often than any other socket has. Genuine
+        retransmissions from a device still come through, as they raise the count on every socket.
+        """
+        key = (addr, bytes(packet))
+        counts = self._copies.get(key)
+        if counts is None:
+            counts = self._copies[key] = {}
+            if len(self._copies) > self.COPY_HISTORY:
+                self._copies.popitem(last=False)
+
+        seen = counts.get(source, 0) + 1
+        counts[source] = seen
+
+        return all(seen > n for s, n in counts.items() if s is not source)
 
     def build_payload(self, cmd, aux_data=b''):
         """
         Build a payload with a random message ID.
         """
-        size = len(aux_data) + self.BASE_PAYLOAD_SIZE
-        device_name_size = len(self.device_name)
+        return self.builder.build(cmd, aux_data)
 
-        if device_name_size > 20:
-            raise dosa.exc.CommsException("Device name cannot exceed 20 bytes")
 
-        payload = bytearray()
-        payload[0:2] = secrets.token_bytes(2)
-        payload[2:5] = cmd
-        payload[5:2] = struct.pack("<H", size)
-        payload[7:7 + device_name_size] = self.device_name
+class Comms(BaseComms):
+    """
+    Blocking UDP transport for the DOSA network.
+    """
 
-        if device_name_size < 20:
-            for i in range(7 + device_name_size, self.BASE_PAYLOAD_SIZE):
-                payload[i:i + 1] = b'\0'
+    # Messages read while waiting on ACKs are held for receive(), beyond this the oldest are dropped
+    MAX_BACKLOG = 1024
 
-        if size > self.BASE_PAYLOAD_SIZE:
-            payload[self.BASE_PAYLOAD_SIZE:] = aux_data
+    # Size of the preallocated buffer datagrams are read into
+    RX_BUFFER_SIZE = 10240
 
-        return payload
+    def __init__(self, device_name=b"Python Script", retransmit=None, rcvbuf=None, interfaces=None, ipv6_group=None):
+        super().__init__(device_name, retransmit, rcvbuf, interfaces, ipv6_group)
+        self.acks = AckTable()
+        self.backlog = collections.deque(maxlen=self.MAX_BACKLOG)
+
+        # Ident of the thread that owns the sockets for reading, None if whichever thread calls receive() reads them
+        self.reader = None
+
+        # Every socket is watched by a single selector, receive() sleeps in the kernel until one is readable
+        self.selector = selectors.DefaultSelector()
+        for sock in self.rx_sockets:
+            self.selector.register(sock, selectors.EVENT_READ)
+
+        # Datagrams are read into one reused buffer and only the bytes received are copied out
+        self.rx_buffer = memoryview(bytearray(self.RX_BUFFER_SIZE))
+        self.rx_lock = threading.Lock()
+
+        # Without /proc, have the kernel report its drop count alongside each datagram
+        if SO_RXQ_OVFL is not None and not os.path.exists(self.PROC_NET_UDP[0]):
+            try:
+                for sock in self.rx_sockets:
+                    sock.setsockopt(socket.SOL_SOCKET, SO_RXQ_OVFL, 1)
+                self.rxq_ovfl = True
+            except OSError:
+                pass
 
     def net_log(self, level, msg):
-        self.send(
-            self.build_payload(
-                Messages.LOG,
-                struct.pack("<B", level) + msg.encode()
-            )
-        )
+        self.send_command(Messages.LOG, struct.pack("<B", level) + msg.encode())
+
+    def send_command(self, cmd, aux_data=b'', tgt=None):
+        """
+        Build and send a message that doesn't need an ACK.
+        """
+        self.transmit(self.builder.build(cmd, aux_data), self.get_target(tgt))
 
-    def send(self, payload, tgt=None, wait_for_ack=False, timeout=3.0):
+    def send(self, payload, tgt=None, wait_for_ack=False, timeout=3.0, policy=None):
         """
         Send a byte-array message to tgt.
 
-        If tgt is None, the multicast group will be used (message broadcasted to all DOSA devices).
+        If tgt is None, the multicast group will be used (message broadcasted to all DOSA devices). When waiting for an
+        ack, the message is retransmitted per `policy`, or the default RetransmitPolicy of this instance.
 
         Returns True if ack'd, False if not ack'd or None if no ack was requested.
         """
-        if tgt is None:
-            tgt = (self.MULTICAST_GROUP, self.MULTICAST_PORT)
-        elif type(tgt) is not tuple:
-            raise Exception("Message target must be a tuple")
-
-        self.sock.sendto(payload, tgt)
-
-        if wait_for_ack:
-            msg_id = struct.unpack("<H", payload[0:2])[0]
-            start_time = time.perf_counter()
-            while (time.perf_counter() - start_time) < timeout:
-                msg = self.receive(timeout=0.1)
-                if msg is not None and msg.msg_code == Messages.ACK:
-                    ack_id = struct.unpack("<H", msg.payload[27:29])[0]
-                    if ack_id == msg_id:
-                        return True
-                # retry message
-                self.sock.sendto(payload, tgt)
-            return False
-        else:
+        if not wait_for_ack:
+            self.transmit(payload, self.get_target(tgt))
             return None
 
+        return self.wait_for_acks([self.send_pending(payload, tgt, policy)], timeout=timeout)
+
+    def send_pending(self, payload, tgt=None, policy=None):
+        """
+        Send a message and register it as awaiting an ACK, without blocking.
+
+        Returns a PendingAck which is completed by whichever call next reads the ACK from the network.
+        """
+        pending = PendingAck(payload, self.get_target(tgt), policy if policy is not None else self.retransmit)
+        self.acks.register(pending)
+        self.transmit(payload, pending.tgt)
+        self.schedule_retransmit(pending)
+        return pending
+
+    def resolve_ack(self, msg):
+        """
+        Offer an ACK to the pending-ACK table, returns True if it completed a request.
+        """
+        completed = self.acks.resolve(msg)
+        for pending in completed:
+            self.record_rtt(pending)
+
+        return len(completed) > 0
+
+    def claim_reader(self):
+        """
+        Make the calling thread the only one that reads the sockets.
+
+        The reader must keep calling receive(), which resolves ACKs; wait_for_acks() on any other thread will then
+        sleep until the reader resolves its ACKs rather than reading the sockets itself.
+        """
+        self.reader = threading.get_ident()
+
+    def release_reader(self):
+        self.reader = None
+
+    def wait_for_acks(self, pending, timeout=3.0):
+        """
+        Block until every PendingAck in `pending` is ack'd, retransmitting those that are not.
+
+        Other traffic read while waiting is queued for receive() rather than discarded. Returns True if everything was
+        ack'd before the timeout.
+        """
+        deadline = time.monotonic() + timeout
+        passive = self.reader is not None and self.reader != threading.get_ident()
+
+        try:
+            while True:
+                outstanding = [p for p in pending if not p.acked]
+                if not outstanding:
+                    return True
+
+                now = time.monotonic()
+                if now >= deadline:
+                    return False
+
+                # retry messages
+                wake = deadline
+                for p in outstanding:
+                    if p.next_send is not None and now >= p.next_send:
+                        self.transmit(p.payload, p.tgt)
+                        p.last_sent = now
+                        p.attempts += 1
+                        self.schedule_retransmit(p)
+                        self.metrics.counter("retransmits_total", "Messages retransmitted for want of an ACK").inc()
+
+                    if p.next_send is not None:
+                        wake = min(wake, p.next_send)
+
+                if passive:
+                    self.acks.wait(outstanding, max(0.0, wake - now))
+                    continue
+
+                msg = self.receive_network(timeout=max(0.0, wake - now))
+                if msg is not None and not (msg.msg_code == Messages.ACK and self.resolve_ack(msg)):
+                    self.backlog.append(msg)
+        finally:
+            for p in pending:
+                self.acks.discard(p)
+
     def send_ack(self, msg_id, tgt):
         """
         Send an ACK for a given message ID back to a target.
@@ -152,19 +847,300 @@ class Comms:
         Message ID must be a 2-byte array.
         Target must be a tuple of (ip, port).
         """
-        self.send(self.build_payload(Messages.ACK, msg_id), tgt)
+        self.send_command(Messages.ACK, msg_id, tgt)
 
     def receive(self, timeout=5.0, max_size=10240):
         """
-        Wait for an return a DOSA Message object containing a received payload.
+        Wait for and return a DOSA Message object containing a received payload.
+
+        Messages queued while waiting on ACKs are returned first. Otherwise blocks until the direct socket or a
+        multicast listener is readable. A timeout of None will wait indefinitely without waking, a timeout of 0 will
+        poll. Returns None if the timeout expires.
+        """
+        if self.backlog:
+            return self.backlog.popleft()
+
+        msg = self.receive_network(timeout, max_size)
+        if msg is not None and msg.msg_code == Messages.ACK:
+            self.resolve_ack(msg)
+
+        return msg
+
+    def receive_network(self, timeout=5.0, max_size=10240):
+        """
+        Wait for a Message from the sockets, bypassing the backlog.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+
+            for key, _ in self.selector.select(remaining):
+                msg = self.read(key.fileobj, max_size)
+                if msg is not None:
+                    return msg
+
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+
+    def receive_batch(self, max_n=64, timeout=5.0):
+        """
+        Return up to `max_n` Messages in one call: those queued while waiting on ACKs, then every datagram ready on
+        any socket.
+
+        Blocks for up to `timeout` only when nothing is ready, the sockets are then drained without waiting again so a
+        burst is read in one pass. Returns an empty list if the timeout expires.
         """
-        start_time = time.perf_counter()
+        msgs = []
+        while self.backlog and len(msgs) < max_n:
+            msgs.append(self.backlog.popleft())
+
+        if len(msgs) >= max_n:
+            return msgs
+
+        ready = [key.fileobj for key, _ in self.selector.select(0 if msgs else timeout)]
+
+        # Take one datagram from each ready socket in turn, until they're empty or the batch is full
+        while ready and len(msgs) < max_n:
+            for sock in list(ready):
+                datagram = self.recv_datagram(sock)
+                if datagram is None:
+                    ready.remove(sock)
+                    continue
+
+                msg = self.to_message(sock, *datagram)
+                if msg is None:
+                    continue
+
+                if msg.msg_code == Messages.ACK:
+                    self.resolve_ack(msg)
+
+                msgs.append(msg)
+                if len(msgs) >= max_n:
+                    break
+
+        return msgs
+
+    def read(self, sock, max_size=10240):
+        """
+        Read a single datagram from a ready socket.
+
+        Returns None if nothing could be read, the datagram isn't a DOSA packet, or it's a copy of a datagram already
+        received on another socket.
+        """
+        datagram = self.recv_datagram(sock, max_size)
+        if datagram is None:
+            return None
+
+        return self.to_message(sock, *datagram)
+
+    def recv_datagram(self, sock, max_size=None):
+        """
+        Read one datagram into the receive buffer without blocking, returns (bytes, addr) or None if none is waiting.
+        """
+        with self.rx_lock:
+            if max_size is not None and max_size > len(self.rx_buffer):
+                self.rx_buffer = memoryview(bytearray(max_size))
+
+            buffer = self.rx_buffer if max_size is None else self.rx_buffer[:max_size]
 
-        while timeout is None or (time.perf_counter() - start_time < timeout):
             try:
-                r = self.sock.recvfrom(max_size)
-                return Message(r[0], r[1])
-            except (socket.timeout, NotDosaPacketException):
-                pass
+                if self.rxq_ovfl:
+                    size, ancdata, _, addr = sock.recvmsg_into([buffer], socket.CMSG_SPACE(4), socket.MSG_DONTWAIT)
+                    for level, kind, data in ancdata:
+                        if level == socket.SOL_SOCKET and kind == SO_RXQ_OVFL and len(data) >= 4:
+                            self.rx_drops[sock] = struct.unpack("=I", data[:4])[0]
+                else:
+                    size, addr = sock.recvfrom_into(buffer, 0, socket.MSG_DONTWAIT)
+            except (BlockingIOError, InterruptedError):
+                return None
 
-        return None
+            return bytes(buffer[:size]), addr
+
+    def to_message(self, sock, packet, addr):
+        """
+        Message for a datagram read from `sock`, or None if it isn't a DOSA packet or is a copy already passed on.
+        """
+        try:
+            msg = Message(packet, addr)
+        except NotDosaPacketException:
+            return None
+
+        if not self.is_first_copy(sock, packet, addr):
+            return None
+
+        return msg
+
+    def close(self):
+        """
+        Release the selector and every socket.
+        """
+        self.selector.close()
+        for sock in self.rx_sockets:
+            sock.close()
+
+
+class AsyncDatagramProtocol(asyncio.DatagramProtocol):
+    """
+    Feeds datagrams from one of the AsyncComms sockets back into the AsyncComms instance.
+    """
+
+    def __init__(self, comms):
+        self.comms = comms
+
+    def datagram_received(self, data, addr):
+        self.comms.datagram_received(self, data, addr)
+
+    def error_received(self, exc):
+        # ICMP errors from unreachable devices are expected on a UDP network
+        pass
+
+
+class AsyncComms(BaseComms):
+    """
+    asyncio transport for the DOSA network.
+
+    Must be started from within a running event loop, after which received messages are available by iterating:
+
+        async with AsyncComms(b"My Tool") as comms:
+            async for msg in comms:
+                ...
+
+    Any number of send_and_wait_ack() calls may be outstanding at once, ACKs are routed to their waiter by message ID
+    while still being delivered to the iterator like any other message.
+    """
+
+    def __init__(self, device_name=b"Python Script", max_queue=1024, retransmit=None, rcvbuf=None, interfaces=None,
+                 ipv6_group=None):
+        super().__init__(device_name, retransmit, rcvbuf, interfaces, ipv6_group)
+        for sock in self.rx_sockets:
+            sock.setblocking(False)
+
+        # Socket -> transport, sends go through the transport of the socket chosen by transmit()
+        self.transports = {}
+        self.queue = asyncio.Queue(max_queue)
+
+        # Message ID -> {future: PendingAck} for every send_and_wait_ack() in progress
+        self.pending = {}
+        self.dropped = 0
+
+    async def start(self):
+        """
+        Attach every socket to the running event loop.
+        """
+        loop = asyncio.get_running_loop()
+        for sock in self.rx_sockets:
+            self.transports[sock], _ = await loop.create_datagram_endpoint(lambda: AsyncDatagramProtocol(self),
+                                                                           sock=sock)
+        return self
+
+    def send_on(self, sock, payload, tgt):
+        self.transports[sock].sendto(payload, tgt)
+
+    def close(self):
+        """
+        Close every transport, which also closes their sockets.
+        """
+        for transport in self.transports.values():
+            transport.close()
+
+        for waiters in self.pending.values():
+            for fut in waiters:
+                fut.cancel()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.queue.get()
+
+    def datagram_received(self, source, data, addr):
+        try:
+            msg = Message(data, addr)
+        except NotDosaPacketException:
+            return
+
+        if not self.is_first_copy(source, data, addr):
+            return
+
+        if msg.msg_code == Messages.ACK and self.pending:
+            for fut, pending in self.pending.get(msg.body.ack_id, {}).items():
+                if not fut.done() and pending.matches(addr):
+                    fut.set_result(time.monotonic())
+
+        # A consumer that falls behind loses the oldest messages rather than stalling the event loop
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+
+        self.queue.put_nowait(msg)
+
+    async def receive(self, timeout=5.0):
+        """
+        Wait for and return the next Message, or None if the timeout expires. A timeout of None waits indefinitely.
+        """
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def send(self, payload, tgt=None):
+        """
+        Send a byte-array message to tgt, or the multicast group if tgt is None.
+        """
+        self.transmit(payload, self.get_target(tgt))
+
+    async def send_and_wait_ack(self, payload, tgt=None, timeout=3.0, policy=None):
+        """
+        Send a message and retransmit it per `policy` (or the instance default) until it is ACK'd or the timeout
+        expires.
+
+        Returns True if ack'd, False if not.
+        """
+        pending = PendingAck(payload, self.get_target(tgt), policy if policy is not None else self.retransmit)
+        fut = asyncio.get_running_loop().create_future()
+        self.pending.setdefault(pending.msg_id, {})[fut] = pending
+
+        try:
+            deadline = pending.sent_at + timeout
+            self.transmit(payload, pending.tgt)
+            self.schedule_retransmit(pending)
+
+            while True:
+                now = time.monotonic()
+                if pending.next_send is not None and now >= pending.next_send:
+                    self.transmit(payload, pending.tgt)
+                    pending.last_sent = now
+                    pending.attempts += 1
+                    self.schedule_retransmit(pending)
+                    self.metrics.counter("retransmits_total", "Messages retransmitted for want of an ACK").inc()
+
+                if now >= deadline:
+                    return False
+
+                wake = deadline if pending.next_send is None else min(deadline, pending.next_send)
+                done, _ = await asyncio.wait({fut}, timeout=max(0.0, wake - now))
+                if done:
+                    pending.acked_at = fut.result()
+                    self.record_rtt(pending)
+                    return True
+        finally:
+            waiters = self.pending[pending.msg_id]
+            waiters.pop(fut, None)
+            if not waiters:
+                del self.pending[pending.msg_id]
+
+    async def send_ack(self, msg_id, tgt):
+        """
+        Send an ACK for a given message ID back to a target.
+        """
+        await self.send(self.build_payload(Messages.ACK, msg_id), tgt)
+
+    async def net_log(self, level, msg):
+        await self.send(self.build_payload(Messages.LOG, struct.pack("<B", level) + msg.encode()))
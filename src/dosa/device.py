@@ -1,3 +1,5 @@
+import heapq
+import itertools
 import time
 
 
@@ -92,3 +94,107 @@ class Device:
 
     def is_stale(self, age=35):
         return time.perf_counter() - self.last_seen > age
+
+
+class DeviceRegistry:
+    """
+    Devices on the network, indexed by address and by name.
+
+    Devices are also held in a min-heap on last_seen, so finding devices that have gone stale costs O(log n) per
+    device seen instead of a pass over every device. The heap is lazy - seeing a device pushes a fresh entry and
+    superseded entries are discarded as they surface.
+    """
+
+    def __init__(self):
+        self.by_address = {}
+        self.by_name = {}
+        self.heap = []
+        self.counter = itertools.count()
+
+    def __len__(self):
+        return len(self.by_address)
+
+    def __iter__(self):
+        return iter(list(self.by_address.values()))
+
+    def __contains__(self, address):
+        return address in self.by_address
+
+    def get(self, address):
+        return self.by_address.get(address)
+
+    def find(self, name):
+        """
+        All devices registered under a device name.
+        """
+        return list(self.by_name.get(name, {}).values())
+
+    def add(self, device):
+        """
+        Register a device, replacing any device already registered at the same address.
+        """
+        self.remove(device.address)
+        self.by_address[device.address] = device
+        self.by_name.setdefault(device.device_name, {})[device.address] = device
+        self.push(device)
+        return device
+
+    def remove(self, address):
+        device = self.by_address.pop(address, None)
+        if device is None:
+            return None
+
+        named = self.by_name.get(device.device_name)
+        if named is not None:
+            named.pop(address, None)
+            if not named:
+                del self.by_name[device.device_name]
+
+        return device
+
+    def clear(self):
+        self.by_address.clear()
+        self.by_name.clear()
+        self.heap.clear()
+
+    def touch(self, device):
+        """
+        Mark a registered device as seen now.
+        """
+        device.pong()
+        self.push(device)
+
+    def push(self, device):
+        heapq.heappush(self.heap, (device.last_seen, next(self.counter), device))
+
+        # Compact once superseded entries clearly outnumber live ones
+        if len(self.heap) > 4 * len(self.by_address) + 16:
+            self.compact()
+
+    def compact(self):
+        live = {}
+        for last_seen, _, device in self.heap:
+            if self.is_current(last_seen, device):
+                live[id(device)] = device
+
+        self.heap = [(d.last_seen, next(self.counter), d) for d in live.values()]
+        heapq.heapify(self.heap)
+
+    def is_current(self, last_seen, device):
+        return self.by_address.get(device.address) is device and device.last_seen == last_seen
+
+    def pop_stale(self, age=35):
+        """
+        Devices that haven't been seen for `age` seconds.
+
+        Each device is returned once, and only becomes eligible again after it has been seen.
+        """
+        cutoff = time.perf_counter() - age
+        stale = []
+
+        while self.heap and self.heap[0][0] < cutoff:
+            last_seen, _, device = heapq.heappop(self.heap)
+            if self.is_current(last_seen, device):
+                stale.append(device)
+
+        return stale
@@ -0,0 +1,286 @@
+import fnmatch
+import json
+import os
+import pathlib
+import tempfile
+
+import dosa
+from dosa.device import DeviceRegistry
+from dosa.exc import DosaException
+from dosa.legacy import SETTINGS
+from dosa.scan import Scanner
+
+
+class FleetState:
+    """
+    The last CONFIG_SETTING payload each device ACK'd for each setting, so an unchanged setting is not sent again.
+
+    Devices are keyed by name rather than address, as addresses change with DHCP leases.
+    """
+
+    def __init__(self, path=None):
+        if path is None:
+            path = pathlib.Path(pathlib.Path.home(), ".dosa", "fleet-state")
+
+        self.path = pathlib.Path(path)
+        self.devices = {}
+        self.load()
+
+    def load(self):
+        try:
+            with self.path.open("r") as file:
+                self.devices = json.load(file)
+        except FileNotFoundError:
+            self.devices = {}
+        except ValueError as e:
+            print("WARNING: Discarding unreadable fleet state: " + str(e))
+            self.devices = {}
+
+    def save(self):
+        """
+        Write the state to a temp file and rename it into place, so an interrupted save never loses the old state.
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=str(self.path.parent), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "w") as file:
+                json.dump(self.devices, file, indent=2, sort_keys=True)
+            os.replace(tmp, str(self.path))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def get(self, device_name, setting):
+        return self.devices.get(device_name, {}).get(setting)
+
+    def set(self, device_name, setting, aux):
+        self.devices.setdefault(device_name, {})[setting] = bytes(aux).hex()
+
+    def rename(self, old_name, new_name):
+        if old_name != new_name and old_name in self.devices:
+            self.devices[new_name] = self.devices.pop(old_name)
+
+
+class Fleet:
+    """
+    Non-interactive configuration of many devices at once.
+
+    Settings are sent to up to `fan_out` devices at a time, and each batch of ACKs is waited on together, so a fleet
+    is configured in roughly one ACK round trip per batch rather than one per device.
+    """
+
+    def __init__(self, comms=None, registry=None, fan_out=16, retransmit=None, timeout=3.0):
+        if comms is None:
+            comms = dosa.Comms()
+
+        if registry is None:
+            registry = DeviceRegistry()
+
+        self.comms = comms
+        self.registry = registry
+        self.fan_out = fan_out
+        self.retransmit = retransmit
+        self.timeout = timeout
+
+    def scan(self, subnet=None):
+        """
+        Populate the registry with the devices that answer a ping, returns the number found.
+        """
+        return sum(1 for _ in Scanner(self.comms, registry=self.registry).scan(subnet))
+
+    def select(self, selector):
+        """
+        Registered devices matching a selector, sorted by name.
+
+        A selector is a comma separated list of terms, a device matching any term is selected. A term is "*" or "all",
+        "type:<device type>" (eg "type:sonar"), an IP address, or a device name which may contain wildcards.
+        """
+        selected = {}
+
+        for term in selector.split(","):
+            term = term.strip()
+            if not term:
+                continue
+
+            for device in self.registry:
+                if self.matches(device, term):
+                    selected[device.address] = device
+
+        return sorted(selected.values(), key=lambda d: (d.device_name, d.address))
+
+    @staticmethod
+    def matches(device, term):
+        if term == "*" or term.lower() == "all":
+            return True
+
+        if term.lower().startswith("type:"):
+            # Either the DeviceType constant (eg "sonar", "ir_passive") or its display name (eg "PIR Sensor")
+            name = term[5:].upper()
+            if getattr(dosa.DeviceType, name.replace("-", "_").replace(" ", "_"), None) == device.device_type:
+                return True
+
+            return dosa.DeviceType.as_string(device.device_type).upper() == name
+
+        if device.address is not None and device.address[0] == term:
+            return True
+
+        return fnmatch.fnmatchcase(device.device_name.lower(), term.lower())
+
+    def apply(self, devices, aux):
+        """
+        Send a CONFIG_SETTING payload to every device, `fan_out` devices at a time.
+
+        Returns a list of (device, PendingAck), the PendingAck holds the ACK status, attempts and latency.
+        """
+        results = []
+
+        for i in range(0, len(devices), self.fan_out):
+            batch = []
+            for device in devices[i:i + self.fan_out]:
+                payload = self.comms.build_payload(dosa.Messages.CONFIG_SETTING, aux)
+                batch.append((device, self.comms.send_pending(payload, device.address, self.retransmit)))
+
+            self.comms.wait_for_acks([pending for _, pending in batch], timeout=self.timeout)
+            results += batch
+
+        return results
+
+    @staticmethod
+    def print_results(results):
+        """
+        Print the outcome of apply(), returns the number of devices that didn't ACK.
+        """
+        failed = 0
+
+        for device, pending in results:
+            if pending.acked:
+                status = "OK " + str(round(pending.latency * 1000)) + " ms"
+            else:
+                status = "FAILED"
+                failed += 1
+
+            print(device.device_name.ljust(22) + device.address[0].ljust(18) + status +
+                  " (" + str(pending.attempts) + (" attempt)" if pending.attempts == 1 else " attempts)"))
+
+        print(str(len(results) - failed) + "/" + str(len(results)) + " devices updated")
+        return failed
+
+    @staticmethod
+    def load_spec(path):
+        """
+        Read a fleet file, JSON or (if PyYAML is installed) YAML.
+
+        {
+            "defaults": {"stats": ["10.0.0.5", 8125]},
+            "devices": {
+                "Front Door": {"lock": "alert", "listen": ["Porch Sensor"]},
+                "type:sonar": {"ranging": [500, 0, 1.5]}
+            }
+        }
+
+        Keys under "devices" are selectors, see select(). Defaults apply to every selected device, and later
+        selectors override earlier ones.
+        """
+        with open(path, "r") as file:
+            if str(path).endswith((".yaml", ".yml")):
+                try:
+                    import yaml
+                except ImportError:
+                    raise DosaException("PyYAML is required for YAML fleet files")
+
+                spec = yaml.safe_load(file)
+            else:
+                spec = json.load(file)
+
+        Fleet.check_spec(spec, path)
+        return spec
+
+    @staticmethod
+    def check_spec(spec, path):
+        """
+        Raise a DosaException naming the file and key if a fleet spec isn't shaped as load_spec() documents.
+        """
+        if not isinstance(spec, dict):
+            raise DosaException(str(path) + ": fleet file must be a mapping, not " + type(spec).__name__)
+
+        defaults = spec.get("defaults", {})
+        if not isinstance(defaults, dict):
+            raise DosaException(str(path) + ": 'defaults' must be a mapping of settings")
+
+        devices = spec.get("devices", {})
+        if not isinstance(devices, dict):
+            raise DosaException(str(path) + ": 'devices' must be a mapping of selectors to settings")
+
+        for selector, settings in devices.items():
+            if not isinstance(settings, dict):
+                raise DosaException(str(path) + ": settings for device '" + str(selector) + "' must be a mapping")
+
+    def plan(self, spec, state=None):
+        """
+        Settings that need sending to bring registered devices in line with a fleet spec.
+
+        Settings a device has already ACK'd, according to `state`, are skipped. Returns a list of (setting, aux,
+        devices), grouping devices that need an identical payload so they're sent together. Renames come last, so other
+        settings are recorded against the name the device had when it ACK'd them.
+        """
+        defaults = spec.get("defaults", {})
+        desired = {}
+
+        for selector, settings in spec.get("devices", {}).items():
+            for device in self.select(selector):
+                if device.address not in desired:
+                    desired[device.address] = (device, dict(defaults))
+                desired[device.address][1].update(settings)
+
+        groups = {}
+        for device, settings in desired.values():
+            for setting, value in settings.items():
+                if setting not in SETTINGS:
+                    raise ValueError("Unknown setting for " + device.device_name + ": " + setting)
+
+                aux = bytes(SETTINGS[setting](self.get_values(value)))
+                if state is not None and state.get(device.device_name, setting) == aux.hex():
+                    continue
+
+                groups.setdefault((setting, aux), []).append(device)
+
+        return sorted(((setting, aux, devices) for (setting, aux), devices in groups.items()),
+                      key=lambda change: change[0] == "name")
+
+    @staticmethod
+    def get_values(value):
+        """
+        A setting from a fleet file as the list of strings the packers take, None (eg to clear wifi) is no values.
+        """
+        if value is None:
+            return []
+
+        if isinstance(value, (list, tuple)):
+            return [str(v) for v in value]
+
+        return [str(value)]
+
+    def apply_spec(self, spec, state, force=False):
+        """
+        Send every setting in `plan()`, recording those that are ACK'd in `state`.
+
+        Returns a list of (setting, results) in the form of apply().
+        """
+        applied = []
+
+        try:
+            for setting, aux, devices in self.plan(spec, None if force else state):
+                results = self.apply(devices, aux)
+                applied.append((setting, results))
+
+                for device, pending in results:
+                    if not pending.acked:
+                        continue
+
+                    state.set(device.device_name, setting, aux)
+                    if setting == "name":
+                        state.rename(device.device_name, aux[1:].decode())
+        finally:
+            state.save()
+
+        return applied
@@ -2,21 +2,27 @@ import time
 import dosa
 import struct
 
-from dosa.device import DeviceType, Device
+from dosa.device import DeviceType, Device, DeviceRegistry
+from dosa.scan import Scanner
 
 
 class Config:
-    def __init__(self, comms=None):
+    def __init__(self, comms=None, retransmit=None, registry=None):
         if comms is None:
             comms = dosa.Comms()
 
+        if registry is None:
+            registry = DeviceRegistry()
+
         self.comms = comms
+        self.retransmit = retransmit
+        self.registry = registry
         self.device_count = 0
         self.devices = []
 
-    def run(self, target=None):
+    def run(self, target=None, subnet=None):
         if target is None:
-            self.run_scan()
+            self.run_scan(subnet)
             if len(self.devices) == 0:
                 print("No devices detected")
                 return
@@ -128,6 +134,15 @@ class Config:
         else:
             print("Failed to update configuration")
 
+    def send_setting(self, device, aux):
+        """
+        Send a CONFIG_SETTING payload to a device and wait for it to be ACK'd.
+
+        Retransmits follow this tool's RetransmitPolicy, or the comms default if it has none.
+        """
+        return self.comms.send(self.comms.build_payload(dosa.Messages.CONFIG_SETTING, aux), tgt=device.address,
+                               wait_for_ack=True, policy=self.retransmit)
+
     def exec_debug_dump(self, device):
         self.comms.send(self.comms.build_payload(dosa.Messages.DEBUG), tgt=device.address,
                         wait_for_ack=False)
@@ -141,174 +156,242 @@ class Config:
                 continue
 
             if device.device_type == DeviceType.UNKNOWN:
-                print("[" + dosa.LogLevel.as_string(struct.unpack("<B", msg.payload[27:28])[0]) + "] " +
-                      msg.addr[0].ljust(18) + msg.device_name.ljust(22) +
-                      msg.payload[28:msg.payload_size].decode("utf-8"))
+                print("[" + dosa.LogLevel.as_string(msg.body.level) + "] " +
+                      msg.addr[0].ljust(18) + msg.device_name.ljust(22) + msg.body.message)
             else:
-                print("[" + dosa.LogLevel.as_string(struct.unpack("<B", msg.payload[27:28])[0]) + "] " +
-                      msg.payload[28:msg.payload_size].decode("utf-8"))
+                print("[" + dosa.LogLevel.as_string(msg.body.level) + "] " + msg.body.message)
 
     def exec_config_mode(self, device):
         return self.comms.send(self.comms.build_payload(dosa.Messages.REQUEST_BT_CFG_MODE), tgt=device.address,
-                               wait_for_ack=True)
+                               wait_for_ack=True, policy=self.retransmit)
+
+    def exec_setting(self, device, packer, values):
+        """
+        Pack values with one of the pack_* functions and send them to a device, printing why if they can't be packed.
+        """
+        try:
+            aux = packer(values)
+        except ValueError as e:
+            print(str(e) + ", aborting")
+            return False
+
+        return self.send_setting(device, aux)
 
     def exec_device_password(self, device, values):
         if values is None:
             return False
 
-        if 4 > len(values[0]) > 50:
-            print("Bad password size (4-50 chars)")
+        return self.exec_setting(device, self.pack_device_password, values)
+
+    def exec_device_name(self, device, values):
+        if values is None:
             return False
 
-        aux = bytearray()
-        aux[0:1] = struct.pack("<B", 0)
-        aux[1:] = values[0].encode()
-        return self.comms.send(self.comms.build_payload(dosa.Messages.CONFIG_SETTING, aux), tgt=device.address,
-                               wait_for_ack=True)
+        return self.exec_setting(device, self.pack_device_name, values)
 
-    def exec_device_name(self, device, values):
+    def exec_wifi_ap(self, device, values):
+        if values is None:
+            print("Clearing wifi details..", end="")
+        else:
+            print("Sending new wifi details..", end="")
+
+        return self.exec_setting(device, self.pack_wifi_ap, values)
+
+    def exec_sensor_calibration(self, device, values):
+        if values is None:
+            return False
+
+        return self.exec_setting(device, self.pack_sensor_calibration, values)
+
+    def exec_door_calibration(self, device, values):
         if values is None:
             return False
 
-        if 2 > len(values[0]) > 20:
-            print("Bad device name (2-20 chars)")
+        return self.exec_setting(device, self.pack_door_calibration, values)
+
+    def exec_ranging_calibration(self, device, values):
+        if values is None:
             return False
 
+        return self.exec_setting(device, self.pack_ranging_calibration, values)
+
+    def exec_relay_calibration(self, device, values):
+        if values is None:
+            return False
+
+        return self.exec_setting(device, self.pack_relay_calibration, values)
+
+    def exec_lock_state(self, device, lock_state):
+        if lock_state is None:
+            return False
+
+        return self.exec_setting(device, self.pack_lock_state, lock_state)
+
+    def exec_listen_devices(self, device, values):
+        if len(values) > 0:
+            print("Sending new device list..")
+        else:
+            print("Set listen mode to all devices..")
+
+        return self.exec_setting(device, self.pack_listen_devices, values)
+
+    def exec_stats_server(self, device, values):
+        if values is None:
+            return False
+
+        return self.exec_setting(device, self.pack_stats_server, values)
+
+    # -- CONFIG_SETTING payloads --
+    # Each takes a list of values as strings, as entered by the user, and raises ValueError if they are malformed.
+
+    @staticmethod
+    def pack_device_password(values):
+        if len(values) != 1 or not 4 <= len(values[0]) <= 50:
+            raise ValueError("Bad password size (4-50 chars)")
+
+        aux = bytearray()
+        aux[0:1] = struct.pack("<B", 0)
+        aux[1:] = values[0].encode()
+        return aux
+
+    @staticmethod
+    def pack_device_name(values):
+        if len(values) != 1 or not 2 <= len(values[0]) <= 20:
+            raise ValueError("Bad device name (2-20 chars)")
+
         aux = bytearray()
         aux[0:1] = struct.pack("<B", 1)
         aux[1:] = values[0].encode()
-        return self.comms.send(self.comms.build_payload(dosa.Messages.CONFIG_SETTING, aux), tgt=device.address,
-                               wait_for_ack=True)
+        return aux
 
-    def exec_wifi_ap(self, device, values):
+    @staticmethod
+    def pack_wifi_ap(values):
+        """
+        Wifi SSID and password, or no values to clear the wifi details.
+        """
         aux = bytearray()
         aux[0:1] = struct.pack("<B", 2)
 
-        if values is None:
-            print("Clearing wifi details..", end="")
+        if not values:
             aux[1:] = "\n".encode()
+        elif len(values) != 2:
+            raise ValueError("Wifi requires an SSID and password")
         else:
-            print("Sending new wifi details..", end="")
             aux[1:] = (values[0] + "\n" + values[1]).encode()
 
-        return self.comms.send(self.comms.build_payload(dosa.Messages.CONFIG_SETTING, aux), tgt=device.address,
-                               wait_for_ack=True)
+        return aux
 
-    def exec_sensor_calibration(self, device, values):
+    @staticmethod
+    def pack_sensor_calibration(values):
         aux = bytearray()
         aux[0:1] = struct.pack("<B", 3)
 
-        if values is None:
-            return False
-        else:
-            try:
-                aux[1:2] = struct.pack("<B", int(values[0]))  # Min pixels
-                aux[2:6] = struct.pack("<f", float(values[1]))  # Single delta
-                aux[6:10] = struct.pack("<f", float(values[2]))  # Total delta
-            except ValueError:
-                print("Malformed calibration data, aborting")
-                return False
+        try:
+            aux[1:2] = struct.pack("<B", int(values[0]))  # Min pixels
+            aux[2:6] = struct.pack("<f", float(values[1]))  # Single delta
+            aux[6:10] = struct.pack("<f", float(values[2]))  # Total delta
+        except (ValueError, IndexError, struct.error):
+            raise ValueError("Malformed calibration data")
 
-        return self.comms.send(self.comms.build_payload(dosa.Messages.CONFIG_SETTING, aux), tgt=device.address,
-                               wait_for_ack=True)
+        return aux
 
-    def exec_door_calibration(self, device, values):
+    @staticmethod
+    def pack_door_calibration(values):
         aux = bytearray()
         aux[0:1] = struct.pack("<B", 4)
 
-        if values is None:
-            return False
-        else:
-            try:
-                aux[1:3] = struct.pack("<H", int(values[0]))  # Open distance
-                aux[3:7] = struct.pack("<L", int(values[1]))  # Open-wait time (ms)
-                aux[7:11] = struct.pack("<L", int(values[2]))  # Cool-down (ms)
-                aux[11:15] = struct.pack("<L", int(values[3]))  # Close ticks
-            except ValueError:
-                print("Malformed calibration data, aborting")
-                return False
+        try:
+            aux[1:3] = struct.pack("<H", int(values[0]))  # Open distance
+            aux[3:7] = struct.pack("<L", int(values[1]))  # Open-wait time (ms)
+            aux[7:11] = struct.pack("<L", int(values[2]))  # Cool-down (ms)
+            aux[11:15] = struct.pack("<L", int(values[3]))  # Close ticks
+        except (ValueError, IndexError, struct.error):
+            raise ValueError("Malformed calibration data")
 
-        return self.comms.send(self.comms.build_payload(dosa.Messages.CONFIG_SETTING, aux), tgt=device.address,
-                               wait_for_ack=True)
+        return aux
 
-    def exec_ranging_calibration(self, device, values):
+    @staticmethod
+    def pack_ranging_calibration(values):
         aux = bytearray()
         aux[0:1] = struct.pack("<B", 5)
 
-        if values is None:
-            return False
-        else:
-            try:
-                aux[1:3] = struct.pack("<H", int(values[0]))  # Trigger threshold
-                aux[3:5] = struct.pack("<H", int(values[1]))  # Fixed calibration
-                aux[5:9] = struct.pack("<f", float(values[2]))  # Trigger coefficient
-            except ValueError:
-                print("Malformed calibration data, aborting")
-                return False
+        try:
+            aux[1:3] = struct.pack("<H", int(values[0]))  # Trigger threshold
+            aux[3:5] = struct.pack("<H", int(values[1]))  # Fixed calibration
+            aux[5:9] = struct.pack("<f", float(values[2]))  # Trigger coefficient
+        except (ValueError, IndexError, struct.error):
+            raise ValueError("Malformed calibration data")
 
-        return self.comms.send(self.comms.build_payload(dosa.Messages.CONFIG_SETTING, aux), tgt=device.address,
-                               wait_for_ack=True)
+        return aux
 
-    def exec_relay_calibration(self, device, values):
+    @staticmethod
+    def pack_relay_calibration(values):
         aux = bytearray()
         aux[0:1] = struct.pack("<B", 8)
 
-        if values is None:
-            return False
-        else:
-            try:
-                aux[1:5] = struct.pack("<L", int(values[0]))  # Relay activation time
-            except ValueError:
-                print("Malformed relay settings, aborting")
-                return False
+        try:
+            aux[1:5] = struct.pack("<L", int(values[0]))  # Relay activation time
+        except (ValueError, IndexError, struct.error):
+            raise ValueError("Malformed relay settings")
 
-        return self.comms.send(self.comms.build_payload(dosa.Messages.CONFIG_SETTING, aux), tgt=device.address,
-                               wait_for_ack=True)
+        return aux
+
+    @staticmethod
+    def pack_lock_state(lock_state):
+        if not isinstance(lock_state, int) or not dosa.LockLevel.UNLOCKED <= lock_state <= dosa.LockLevel.BREACH:
+            raise ValueError("Lock state must be " + ", ".join(
+                dosa.LockLevel.as_string(level) + " (" + str(level) + ")"
+                for level in range(dosa.LockLevel.UNLOCKED, dosa.LockLevel.BREACH + 1)
+            ))
 
-    def exec_lock_state(self, device, lock_state):
         aux = bytearray()
         aux[0:1] = struct.pack("<B", 6)
+        aux[1:2] = struct.pack("<B", lock_state)  # Lock state
+        return aux
 
-        if lock_state is None:
-            return False
-        else:
-            try:
-                aux[1:2] = struct.pack("<B", lock_state)  # Lock state
-            except ValueError:
-                print("Malformed lock data, aborting")
-                return False
+    @staticmethod
+    def pack_lock_values(values):
+        """
+        Lock state by name (UNLOCKED, LOCKED, ALERT, BREACH) or number.
+        """
+        if len(values) != 1:
+            raise ValueError("Lock state requires one value")
 
-        return self.comms.send(self.comms.build_payload(dosa.Messages.CONFIG_SETTING, aux), tgt=device.address,
-                               wait_for_ack=True)
+        for lock_state in range(dosa.LockLevel.BREACH + 1):
+            if values[0].upper() == dosa.LockLevel.as_string(lock_state):
+                return Config.pack_lock_state(lock_state)
 
-    def exec_listen_devices(self, device, values):
+        try:
+            lock_state = int(values[0])
+        except ValueError:
+            raise ValueError("Malformed lock data")
+
+        return Config.pack_lock_state(lock_state)
+
+    @staticmethod
+    def pack_listen_devices(values):
+        """
+        Device names to listen to, an empty list listens to all devices.
+        """
         aux = bytearray()
         aux[0:1] = struct.pack("<B", 7)
         if len(values) > 0:
             aux[1:] = ("\n".join(values) + "\n").encode()
-            print("Sending new device list..")
-        else:
-            print("Set listen mode to all devices..")
 
-        return self.comms.send(self.comms.build_payload(dosa.Messages.CONFIG_SETTING, aux), tgt=device.address,
-                               wait_for_ack=True)
+        return aux
 
-    def exec_stats_server(self, device, values):
+    @staticmethod
+    def pack_stats_server(values):
         aux = bytearray()
         aux[0:1] = struct.pack("<B", 9)
 
-        if values is None:
-            return False
-        else:
-            try:
-                aux[1:3] = struct.pack("<H", int(values[1]))  # Server port
-                aux[3:] = values[0].encode()  # Server address
-            except ValueError:
-                print("Malformed server settings, aborting")
-                return False
+        try:
+            aux[1:3] = struct.pack("<H", int(values[1]))  # Server port
+            aux[3:] = values[0].encode()  # Server address
+        except (ValueError, IndexError, struct.error):
+            raise ValueError("Malformed server settings")
 
-        return self.comms.send(self.comms.build_payload(dosa.Messages.CONFIG_SETTING, aux), tgt=device.address,
-                               wait_for_ack=True)
+        return aux
 
     @staticmethod
     def get_values(vals):
@@ -327,37 +410,14 @@ class Config:
 
         return r_vals
 
-    def run_scan(self):
-        ping = self.comms.build_payload(dosa.Messages.PING)
-
-        retries = 5
-        timeout = 0.1
+    def run_scan(self, subnet=None):
         self.devices = []
 
         print("Scanning..")
 
-        for attempt in range(retries):
-            self.comms.send(ping)
-            start_time = time.perf_counter()
-
-            while time.perf_counter() - start_time < timeout:
-                msg = self.comms.receive(timeout=timeout)
-
-                if msg is None or msg.msg_code != dosa.Messages.PONG:
-                    continue
-
-                for d in self.devices:
-                    if d.address[0] == msg.addr[0]:
-                        msg = None
-                        break
-
-                if msg is None:
-                    continue
-
-                d = Device(msg=msg, device_type=msg.payload[self.comms.BASE_PAYLOAD_SIZE],
-                           device_state=msg.payload[self.comms.BASE_PAYLOAD_SIZE + 1])
-                self.devices.append(d)
-                self.device_count += 1
+        for d in Scanner(self.comms, registry=self.registry).scan(subnet):
+            self.devices.append(d)
+            self.device_count += 1
 
         self.devices.sort(key=lambda x: x.msg.device_name)
 
@@ -437,3 +497,18 @@ class Config:
                 return opt - 1
             else:
                 print("Invalid option")
+
+
+# Setting names, as used on the command line, to the Config function that packs their values
+SETTINGS = {
+    "password": Config.pack_device_password,
+    "name": Config.pack_device_name,
+    "wifi": Config.pack_wifi_ap,
+    "sensor": Config.pack_sensor_calibration,
+    "door": Config.pack_door_calibration,
+    "ranging": Config.pack_ranging_calibration,
+    "relay": Config.pack_relay_calibration,
+    "lock": Config.pack_lock_values,
+    "listen": Config.pack_listen_devices,
+    "stats": Config.pack_stats_server,
+}
@@ -0,0 +1,246 @@
+import bisect
+import http.server
+import threading
+import time
+
+# Histogram bucket upper bounds, in seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Counter:
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, value=1):
+        with self.lock:
+            self.value += value
+
+
+class Histogram:
+    def __init__(self, name, labels, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.labels = labels
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self):
+        return Timer(self)
+
+
+class Timer:
+    """
+    Context manager observing the time spent in its block.
+    """
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class NullInstrument:
+    """
+    Stands in for every counter, histogram and timer when metrics are disabled.
+    """
+
+    def inc(self, value=1):
+        pass
+
+    def observe(self, value):
+        pass
+
+    def time(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+
+NULL_INSTRUMENT = NullInstrument()
+
+
+class NullMetrics:
+    """
+    The metrics registry when metrics are disabled, every instrument it returns does nothing.
+    """
+    enabled = False
+
+    def counter(self, name, help_text="", **labels):
+        return NULL_INSTRUMENT
+
+    def histogram(self, name, help_text="", **labels):
+        return NULL_INSTRUMENT
+
+
+# Shared by everything that hasn't been given a real registry
+NULL = NullMetrics()
+
+
+class Metrics:
+    """
+    Registry of counters and histograms, exported as Prometheus text or pushed to statsd via Telemetry.
+
+    Instruments are created on first use and found again by name and labels, so call sites can simply ask for the
+    instrument they need; hot paths should hold on to instruments without labels.
+    """
+    enabled = True
+
+    def __init__(self, prefix="dosa"):
+        self.prefix = prefix
+        self.instruments = {}
+        self.help = {}
+        self.types = {}
+        self.lock = threading.Lock()
+
+        # Counter and histogram totals last pushed to statsd, to send only the change
+        self.published = {}
+
+    def counter(self, name, help_text="", **labels):
+        return self.get(Counter, "counter", name, help_text, labels)
+
+    def histogram(self, name, help_text="", **labels):
+        return self.get(Histogram, "histogram", name, help_text, labels)
+
+    def get(self, cls, kind, name, help_text, labels):
+        key = (name, tuple(sorted(labels.items())) if labels else ())
+        instrument = self.instruments.get(key)
+        if instrument is not None:
+            return instrument
+
+        with self.lock:
+            instrument = self.instruments.get(key)
+            if instrument is None:
+                instrument = self.instruments[key] = cls(self.prefix + "_" + name, key[1])
+                self.types.setdefault(instrument.name, kind)
+                if help_text:
+                    self.help.setdefault(instrument.name, help_text)
+
+        return instrument
+
+    def render(self):
+        """
+        All instruments in the Prometheus text exposition format.
+        """
+        with self.lock:
+            instruments = sorted(self.instruments.values(), key=lambda i: (i.name, i.labels))
+
+        lines = []
+        last_name = None
+        for instrument in instruments:
+            if instrument.name != last_name:
+                last_name = instrument.name
+                if instrument.name in self.help:
+                    lines.append("# HELP " + instrument.name + " " + self.help[instrument.name])
+                lines.append("# TYPE " + instrument.name + " " + self.types[instrument.name])
+
+            if isinstance(instrument, Counter):
+                lines.append(instrument.name + self.format_labels(instrument.labels) + " " + str(instrument.value))
+                continue
+
+            with instrument.lock:
+                counts = list(instrument.counts)
+                total = instrument.sum
+                count = instrument.count
+
+            cumulative = 0
+            for bound, n in zip(instrument.buckets + (None,), counts):
+                cumulative += n
+                le = "+Inf" if bound is None else repr(bound)
+                lines.append(instrument.name + "_bucket" + self.format_labels(instrument.labels + (("le", le),)) +
+                             " " + str(cumulative))
+
+            lines.append(instrument.name + "_sum" + self.format_labels(instrument.labels) + " " + repr(total))
+            lines.append(instrument.name + "_count" + self.format_labels(instrument.labels) + " " + str(count))
+
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def format_labels(labels):
+        if not labels:
+            return ""
+
+        return "{" + ",".join(k + '="' + str(v).replace("\\", "\\\\").replace('"', '\\"') + '"'
+                              for k, v in labels) + "}"
+
+    def publish(self, telemetry):
+        """
+        Push the change in every counter, and each histogram's count and sum, to statsd via a Telemetry instance.
+        """
+        with self.lock:
+            instruments = list(self.instruments.values())
+
+        for instrument in instruments:
+            # Telemetry adds its own prefix
+            name = telemetry.metric_name(instrument.name[len(self.prefix) + 1:], *(v for _, v in instrument.labels))
+
+            if isinstance(instrument, Counter):
+                values = {name: instrument.value}
+            else:
+                values = {name + ".count": instrument.count, name + ".sum_ms": round(instrument.sum * 1000)}
+
+            for key, value in values.items():
+                delta = value - self.published.get(key, 0)
+                if delta:
+                    telemetry.incr(key, delta)
+                    self.published[key] = value
+
+
+class MetricsServer:
+    """
+    Serves a registry as Prometheus text at /metrics from a background thread.
+    """
+
+    def __init__(self, metrics, port=9108, address="127.0.0.1"):
+        self.metrics = metrics
+
+        registry = metrics
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, fmt, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer((address, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name="metrics-http", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -1,10 +1,16 @@
 import dosa
-import struct
 import time
 
 
 class Monitor:
-    def __init__(self, comms=None, ignore=False, ack=False, map=False, ignore_pings=False):
+    """
+    Prints DOSA traffic, with the detail for each message code added by a handler.
+
+    Handlers are called with the message and whether it's a retry, and return text to append to the printed line.
+    """
+
+    def __init__(self, comms=None, ignore=False, ack=False, map=False, ignore_pings=False, history_size=1024,
+                 history_ttl=30.0, plugins=None):
         if comms is None:
             comms = dosa.Comms()
 
@@ -14,15 +20,32 @@ class Monitor:
         self.auto_ack = ack
         self.print_map = map
         self.ignore_pings = ignore_pings
-        self.history = dosa.MessageLog()
+        self.history = dosa.MessageLog(max_history=history_size, ttl=history_ttl)
+
+        self.handlers = dosa.HandlerRegistry()
+        self.handlers.register(dosa.Messages.TRIGGER, self.handle_trigger)
+        self.handlers.register(dosa.Messages.LOG, self.handle_log)
+        self.handlers.register(dosa.Messages.SEC, self.handle_sec)
+        self.handlers.register(dosa.Messages.PLAY, self.handle_play)
+        self.add_label(dosa.Messages.ONLINE, "ONLINE")
+        self.add_label(dosa.Messages.BEGIN, "BEGIN SEQUENCE")
+        self.add_label(dosa.Messages.END, "COMPLETE")
+        self.add_label(dosa.Messages.PING, "PING")
+        self.add_label(dosa.Messages.PONG, "PONG")
+        self.add_label(dosa.Messages.FLUSH, "FLUSH")
+
+        # Modules with extra handlers, each has a register(registry, monitor) function
+        if plugins:
+            self.handlers.load_plugins(plugins, self)
+
+    def add_label(self, code, label):
+        self.handlers.register(code, lambda msg, is_retry: " // " + label)
 
     def run(self):
         while True:
             msg = self.comms.receive(timeout=None)
-            aux = ""
 
-            device = dosa.Device(msg=msg)
-            is_retry = self.history.validate(device, msg.msg_id)
+            is_retry = self.history.check(msg.addr, msg.msg_id)
 
             if self.ignore_retries and is_retry:
                 continue
@@ -32,59 +55,61 @@ class Monitor:
 
             if msg.msg_code == dosa.Messages.ACK:
                 continue
-            elif msg.msg_code == dosa.Messages.TRIGGER and not is_retry:
-                if self.auto_ack:
-                    self.comms.send_ack(msg.msg_id_bytes(), msg.addr)
-                    aux += " (replied)"
-                if self.print_map:
-                    trigger_type = struct.unpack("<B", msg.payload[27:28])[0]
-                    if trigger_type == 3:
-                        # Ranging sensor, show distances
-                        dist_prev = struct.unpack("<H", msg.payload[28:30])[0]
-                        dist_new = struct.unpack("<H", msg.payload[30:32])[0]
-                        aux += " // distance: " + str(dist_prev) + " -> " + str(dist_new)
-                    elif trigger_type == 4:
-                        # IR grid, display map
-                        aux += "\n+--------+\n"
-                        index = 0
-                        for row in range(8):
-                            aux += "|"
-                            for col in range(8):
-                                aux += self.print_pixel(struct.unpack("<B", msg.payload[28 + index:29 + index])[0])
-                                index += 1
-                            aux += "|\n"
-                        aux += "+--------+"
-            elif msg.msg_code == dosa.Messages.LOG:
-                log_level = struct.unpack("<B", msg.payload[27:28])[0]
-                log_message = msg.payload[28:msg.payload_size].decode("utf-8")
-                aux = " // [" + dosa.LogLevel.as_string(log_level) + "] " + log_message
-            elif msg.msg_code == dosa.Messages.SEC:
-                sec_level = struct.unpack("<B", msg.payload[27:28])[0]
-                aux = " // SECURITY ALERT: " + dosa.SecurityLevel.as_string(sec_level)
-            elif msg.msg_code == dosa.Messages.PLAY:
-                play = msg.payload[27:msg.payload_size].decode("utf-8")
-                aux = " // RUN PLAY: " + play
-            elif msg.msg_code == dosa.Messages.ONLINE:
-                aux = " // ONLINE"
-            elif msg.msg_code == dosa.Messages.BEGIN:
-                aux = " // BEGIN SEQUENCE"
-            elif msg.msg_code == dosa.Messages.END:
-                aux = " // COMPLETE"
-            elif msg.msg_code == dosa.Messages.PING:
-                aux = " // PING"
-            elif msg.msg_code == dosa.Messages.PONG:
-                aux = " // PONG"
-            elif msg.msg_code == dosa.Messages.FLUSH:
-                aux = " // FLUSH"
-
-            # Timestamp of message
-            t = time.strftime("%H:%M:%S", time.localtime())
-
-            print(t + " [" + str(msg.msg_id).rjust(5, ' ') + "] " + msg.addr[0] + ":" + str(msg.addr[1]) +
-                  " (" + msg.device_name + "): " + msg.msg_code.decode("utf-8") + aux)
 
+            print(self.format(msg, is_retry))
             self.last_msg_id = msg.msg_id
 
+    def format(self, msg, is_retry=False):
+        """
+        The line printed for a message, including the detail added by its handlers.
+        """
+        aux = "".join(a for a in self.handlers.dispatch(msg, is_retry) if a)
+
+        # Timestamp of message
+        t = time.strftime("%H:%M:%S", time.localtime())
+
+        return t + " [" + str(msg.msg_id).rjust(5, ' ') + "] " + msg.addr[0] + ":" + str(msg.addr[1]) + \
+            " (" + msg.device_name + "): " + msg.msg_code.decode("utf-8") + aux
+
+    def handle_trigger(self, msg, is_retry):
+        aux = ""
+        if is_retry:
+            return aux
+
+        if self.auto_ack:
+            self.comms.send_ack(msg.msg_id_bytes(), msg.addr)
+            aux += " (replied)"
+
+        if self.print_map:
+            trigger = msg.body
+            if trigger.trigger_type == dosa.TriggerType.RANGING:
+                # Ranging sensor, show distances
+                aux += " // distance: " + str(trigger.dist_prev) + " -> " + str(trigger.dist_new)
+            elif trigger.trigger_type == dosa.TriggerType.IR_GRID:
+                # IR grid, display map
+                aux += "\n+--------+\n"
+                for row in trigger.rows():
+                    aux += "|"
+                    for p in row:
+                        aux += self.print_pixel(p)
+                    aux += "|\n"
+                aux += "+--------+"
+
+        return aux
+
+    @staticmethod
+    def handle_log(msg, is_retry):
+        log = msg.body
+        return " // [" + dosa.LogLevel.as_string(log.level) + "] " + log.message
+
+    @staticmethod
+    def handle_sec(msg, is_retry):
+        return " // SECURITY ALERT: " + dosa.SecurityLevel.as_string(msg.body.level)
+
+    @staticmethod
+    def handle_play(msg, is_retry):
+        return " // RUN PLAY: " + msg.body.play
+
     @staticmethod
     def print_pixel(p):
         if p == 0:
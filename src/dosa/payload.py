@@ -0,0 +1,167 @@
+import struct
+
+# Size of the fixed DOSA header, auxiliary data follows it
+HEADER_SIZE = 27
+
+UINT16 = struct.Struct("<H")
+
+
+class TriggerType:
+    UNKNOWN = 0
+    BUTTON = 1
+    SENSOR = 2
+    RANGING = 3
+    IR_GRID = 4
+    AUTO = 100
+
+    @staticmethod
+    def as_string(trigger_type):
+        if trigger_type == TriggerType.UNKNOWN:
+            return "UNKNOWN"
+        elif trigger_type == TriggerType.BUTTON:
+            return "BUTTON"
+        elif trigger_type == TriggerType.SENSOR:
+            return "SENSOR"
+        elif trigger_type == TriggerType.RANGING:
+            return "RANGE"
+        elif trigger_type == TriggerType.IR_GRID:
+            return "MAP"
+        elif trigger_type == TriggerType.AUTO:
+            return "AUTO"
+        else:
+            return "UNKNOWN"
+
+
+class Payload:
+    """
+    Typed view over the auxiliary data of a message.
+
+    The data is a memoryview over the received packet, so fields are read in place without copying. Fields that fall
+    outside a short payload read as None.
+    """
+    __slots__ = ("data",)
+
+    def __init__(self, msg):
+        self.data = memoryview(msg.payload)[HEADER_SIZE:msg.payload_size]
+
+    @classmethod
+    def decode(cls, msg):
+        return cls(msg)
+
+    def byte(self, offset):
+        if offset < len(self.data):
+            return self.data[offset]
+
+        return None
+
+    def uint16(self, offset):
+        if offset + 2 <= len(self.data):
+            return UINT16.unpack_from(self.data, offset)[0]
+
+        return None
+
+    def text(self, offset=0):
+        return str(self.data[offset:], "utf-8", errors="replace")
+
+
+class AckPayload(Payload):
+    __slots__ = ()
+
+    @property
+    def ack_id(self):
+        return self.uint16(0)
+
+
+class LogPayload(Payload):
+    __slots__ = ()
+
+    @property
+    def level(self):
+        return self.byte(0)
+
+    @property
+    def message(self):
+        return self.text(1)
+
+
+class SecPayload(Payload):
+    __slots__ = ()
+
+    @property
+    def level(self):
+        return self.byte(0)
+
+
+class PlayPayload(Payload):
+    __slots__ = ()
+
+    @property
+    def play(self):
+        return self.text()
+
+
+class PongPayload(Payload):
+    __slots__ = ()
+
+    @property
+    def device_type(self):
+        return self.byte(0)
+
+    @property
+    def device_state(self):
+        return self.byte(1)
+
+
+class TriggerPayload(Payload):
+    """
+    Trigger messages, decode() returns a subclass matching the trigger type where the trigger carries extra data.
+    """
+    __slots__ = ()
+
+    # Trigger type to payload class, trigger types not listed decode as a plain TriggerPayload
+    variants = {}
+
+    @classmethod
+    def register(cls, trigger_type, payload_type):
+        cls.variants[trigger_type] = payload_type
+
+    @classmethod
+    def decode(cls, msg):
+        view = cls(msg)
+        variant = cls.variants.get(view.trigger_type)
+        return view if variant is None else variant(msg)
+
+    @property
+    def trigger_type(self):
+        return self.byte(0)
+
+
+class RangeTriggerPayload(TriggerPayload):
+    __slots__ = ()
+
+    @property
+    def dist_prev(self):
+        return self.uint16(1)
+
+    @property
+    def dist_new(self):
+        return self.uint16(3)
+
+
+class IrGridTriggerPayload(TriggerPayload):
+    __slots__ = ()
+
+    GRID_SIZE = 8
+
+    @property
+    def pixels(self):
+        return self.data[1:1 + self.GRID_SIZE * self.GRID_SIZE]
+
+    def rows(self):
+        pixels = self.pixels
+        for row in range(self.GRID_SIZE):
+            yield pixels[row * self.GRID_SIZE:(row + 1) * self.GRID_SIZE]
+
+
+TriggerPayload.register(TriggerType.RANGING, RangeTriggerPayload)
+TriggerPayload.register(TriggerType.IR_GRID, IrGridTriggerPayload)
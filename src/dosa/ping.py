@@ -1,40 +1,174 @@
-import dosa
+import math
+import socket
 import time
 
+import dosa
+
+
+class PingStats:
+    """
+    Round trip times for one device across a run of pings.
+    """
+
+    def __init__(self, address, device_name=None):
+        self.address = address
+        self.device_name = device_name
+        self.device_type = None
+        self.device_state = None
+        self.sent = 0
+        self.rtts = []
+
+    @property
+    def received(self):
+        return len(self.rtts)
+
+    @property
+    def loss(self):
+        """
+        Fraction of pings unanswered, between 0 and 1.
+        """
+        if self.sent == 0:
+            return 0.0
+
+        return 1.0 - min(self.received, self.sent) / self.sent
+
+    @property
+    def min(self):
+        return min(self.rtts) if self.rtts else None
+
+    @property
+    def max(self):
+        return max(self.rtts) if self.rtts else None
+
+    @property
+    def avg(self):
+        return sum(self.rtts) / len(self.rtts) if self.rtts else None
+
+    @property
+    def p95(self):
+        if not self.rtts:
+            return None
+
+        ordered = sorted(self.rtts)
+        return ordered[max(0, math.ceil(0.95 * len(ordered)) - 1)]
+
 
 class Ping:
+    """
+    Pings any number of devices, or every device via the multicast group, in rounds.
+
+    Each round pings every target at once. PONGs don't echo the ping's message ID, so a reply is matched to the round in
+    flight by its source address, and only the first reply from each address per round counts.
+    """
+
     def __init__(self, comms=None):
         if comms is None:
             comms = dosa.Comms()
 
         self.comms = comms
 
-    def run(self, target):
-        ping = self.comms.build_payload(dosa.Messages.PING)
-        print("PING > " + target + ":6901")
-        self.comms.send(ping, (target, 6901))
+    def ping(self, targets=None, count=3, interval=1.0):
+        """
+        Ping targets `count` times, waiting `interval` seconds for the replies to each round.
+
+        Targets are host names, IPs or (host, port) tuples; None pings the multicast group and reports every device that
+        answers. Returns a dict of address to PingStats.
+        """
+        if isinstance(targets, str):
+            targets = [targets]
+
+        stats = {}
+        addresses = None
+
+        if targets is not None:
+            addresses = []
+            for target in targets:
+                address = self.resolve(target)
+                addresses.append(address)
+                stats[address] = PingStats(address)
+
+        for _ in range(count):
+            # Build a ping per round, the same payload sent again would be dropped by retransmit suppression
+            ping = self.comms.build_payload(dosa.Messages.PING)
+            answered = set()
+            sent_at = time.monotonic()
+
+            if addresses is None:
+                self.comms.send(ping)
+            else:
+                for address in addresses:
+                    self.comms.send(ping, address)
+                    stats[address].sent += 1
+
+            deadline = sent_at + interval
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+
+                msg = self.comms.receive(timeout=remaining)
+                if msg is None or msg.msg_code != dosa.Messages.PONG or msg.addr in answered:
+                    continue
+
+                if addresses is not None and msg.addr not in stats:
+                    continue
+
+                answered.add(msg.addr)
+                entry = stats.setdefault(msg.addr, PingStats(msg.addr))
+                entry.device_name = msg.device_name
+                entry.device_type = msg.body.device_type
+                entry.device_state = msg.body.device_state
+                entry.rtts.append(time.monotonic() - sent_at)
+
+        # Every device was pinged every round when pinging the group, whether or not it was known yet
+        if addresses is None:
+            for entry in stats.values():
+                entry.sent = count
+
+        return stats
+
+    def run(self, targets=None, count=3, interval=1.0):
+        """
+        Ping and print a summary line per device, returns True if every device answered every ping.
+        """
+        if isinstance(targets, str):
+            targets = [targets]
+
+        if targets:
+            print("PING > " + ", ".join(targets) + " (" + str(count) + " rounds)")
+        else:
+            print("PING > " + self.comms.MULTICAST_GROUP + " (" + str(count) + " rounds)")
 
-        timeout = 1.5
-        start_time = time.perf_counter()
+        stats = self.ping(targets, count, interval)
+        if not stats:
+            print("No reply")
+            return False
 
-        while time.perf_counter() - start_time < timeout:
-            msg = self.comms.receive(timeout=timeout)
+        healthy = True
+        for entry in sorted(stats.values(), key=lambda e: (e.device_name or "", e.address)):
+            self.print_details(entry)
+            healthy = healthy and entry.loss == 0
 
-            if msg is None or msg.msg_code != dosa.Messages.PONG:
-                continue
+        return healthy
 
-            if msg is None:
-                continue
+    def resolve(self, target):
+        host, port = target if isinstance(target, tuple) else (target, self.comms.MULTICAST_PORT)
 
-            if msg is not None and msg.msg_code == dosa.Messages.PONG:
-                self.print_details(msg)
-                return
+        try:
+            return socket.gethostbyname(host), port
+        except socket.gaierror:
+            raise dosa.DosaException("Unknown host: " + str(host))
 
-        print("No reply")
+    @staticmethod
+    def print_details(entry):
+        name = entry.device_name if entry.device_name is not None else "?"
+        line = name.ljust(22) + entry.address[0].ljust(18) + ": xmt/rcv/%loss = " + str(entry.sent) + "/" + \
+            str(entry.received) + "/" + str(round(entry.loss * 100)) + "%"
 
-    def print_details(self, msg):
-        dvc_type = msg.payload[self.comms.BASE_PAYLOAD_SIZE]
-        dvc_state = msg.payload[self.comms.BASE_PAYLOAD_SIZE + 1]
+        if entry.rtts:
+            line += ", min/avg/p95/max = " + "/".join(
+                str(round(rtt * 1000, 1)) for rtt in (entry.min, entry.avg, entry.p95, entry.max)
+            ) + " ms // " + dosa.DeviceType.as_string(entry.device_type) + "::" + \
+                dosa.DeviceStatus.as_string(entry.device_state)
 
-        print("PONG < " + msg.addr[0] + ":" + str(msg.addr[1]) + " (" + msg.device_name + ") // " +
-              dosa.device.device_type_str(dvc_type) + "::" + dosa.device.device_status_str(dvc_state))
+        print(line)
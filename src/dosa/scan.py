@@ -0,0 +1,151 @@
+import ipaddress
+import time
+
+import dosa
+from dosa.device import Device
+
+
+class Scanner:
+    """
+    Finds devices on the network by pinging them, yielding each device as it first answers.
+
+    Rather than listening for a fixed time, a round of listening ends once no device has answered for a quiet
+    period that grows with the largest gap seen between answers, so a slow Wi-Fi network is given longer than a fast
+    LAN. Multicast pings are repeated for lost packets, but the scan ends as soon as a round finds nothing new. Later
+    rounds wait only as long as the quiet period the first round settled on, rather than the full `first_reply`.
+
+    A subnet may also be swept with unicast pings, for devices that don't see multicast traffic, paced at `sweep_rate`
+    pings per second so the sweep doesn't flood the network.
+    """
+
+    def __init__(self, comms=None, registry=None, rounds=5, min_rounds=2, first_reply=1.0, min_quiet=0.1,
+                 gap_factor=3.0, max_time=10.0, sweep_rate=500):
+        if comms is None:
+            comms = dosa.Comms()
+
+        self.comms = comms
+        self.registry = registry
+
+        # Multicast ping rounds, a scan always runs at least min_rounds
+        self.rounds = rounds
+        self.min_rounds = min_rounds
+
+        # Time to wait for the first answer of a round, and the bounds of the quiet period that ends it
+        self.first_reply = first_reply
+        self.min_quiet = min_quiet
+        self.gap_factor = gap_factor
+        self.max_time = max_time
+        self.sweep_rate = sweep_rate
+
+        # Quiet period the first round with answers ended on, None until then
+        self.quiet = None
+
+        self.rounds_sent = 0
+        self.swept = 0
+        self.elapsed = 0
+
+    def scan(self, subnet=None):
+        """
+        Generator of Device objects, in the order they answer.
+
+        `subnet` may be a network such as "192.168.1.0/24", every host in it is also sent a unicast ping.
+        """
+        seen = set()
+        start = time.monotonic()
+        deadline = start + self.max_time
+
+        self.rounds_sent = 0
+        self.swept = 0
+        self.quiet = None
+
+        for _ in range(self.rounds):
+            # A new message ID each round, as devices may ignore a repeated one as a retransmit
+            ping = self.comms.build_payload(dosa.Messages.PING)
+            self.comms.send(ping)
+            self.rounds_sent += 1
+
+            if subnet is not None and self.rounds_sent == 1:
+                self.sweep(ping, subnet, deadline)
+
+            found = 0
+            for device in self.listen(seen, deadline):
+                found += 1
+                yield device
+
+            if time.monotonic() >= deadline or (found == 0 and self.rounds_sent >= self.min_rounds):
+                break
+
+        self.elapsed = time.monotonic() - start
+
+    def sweep(self, ping, subnet, deadline=None):
+        """
+        Send a unicast ping to every host in a subnet without waiting for answers, answers are read by listen().
+        """
+        interval = 1.0 / self.sweep_rate if self.sweep_rate else 0
+        next_send = time.monotonic()
+
+        for host in ipaddress.ip_network(subnet, strict=False).hosts():
+            now = time.monotonic()
+            if deadline is not None and now >= deadline:
+                return
+
+            if next_send > now:
+                time.sleep(next_send - now)
+            next_send = max(next_send, now) + interval
+
+            try:
+                self.comms.send(ping, (str(host), self.comms.MULTICAST_PORT))
+                self.swept += 1
+            except OSError:
+                # Unreachable hosts on some platforms
+                continue
+
+    def listen(self, seen, deadline):
+        """
+        Yield new devices until the arrival of answers drops off.
+
+        Answers from devices already seen still count as arrivals, so a round that only hears repeats ends as soon
+        as they stop.
+        """
+        last = time.monotonic()
+        wait = self.first_reply if self.quiet is None else self.quiet
+        max_gap = 0
+
+        try:
+            while True:
+                now = time.monotonic()
+                remaining = min(last + wait, deadline) - now
+                if remaining <= 0:
+                    return
+
+                msg = self.comms.receive(timeout=remaining)
+                if msg is None or msg.msg_code != dosa.Messages.PONG:
+                    continue
+
+                now = time.monotonic()
+                max_gap = max(max_gap, now - last)
+                wait = max(self.min_quiet, min(self.first_reply, self.gap_factor * max_gap))
+                last = now
+
+                if msg.addr not in seen:
+                    seen.add(msg.addr)
+                    yield self.register(msg)
+        finally:
+            if self.quiet is None and max_gap:
+                self.quiet = wait
+
+    def register(self, msg):
+        """
+        Device for a PONG, added to or refreshed in the registry if the scanner has one.
+        """
+        device = None if self.registry is None else self.registry.get(msg.addr)
+        if device is None:
+            device = Device(msg=msg)
+            if self.registry is not None:
+                self.registry.add(device)
+        else:
+            self.registry.touch(device)
+
+        device.device_type = msg.body.device_type
+        device.device_state = msg.body.device_state
+        return device
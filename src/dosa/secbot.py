@@ -1,34 +1,58 @@
 import dosa
-import struct
+import queue
+import threading
 import time
-import json
 from boto3 import Session
-from botocore.exceptions import ClientError
-from dosa.tts import Tts
+from dosa.alerts import AlertDispatcher
+from dosa.metrics import Metrics, MetricsServer, NULL as NULL_METRICS
+from dosa.telemetry import Telemetry
+from dosa.tts import Tts, Priority
 
 
 class SecBot:
     """
     Monitors for security alerts and errors. Vocalises them though TTS.
+
+    When running, a receiver thread drains the sockets into the inbox, a scheduler thread sends heartbeats and pings
+    and checks for stale devices, and packets are dispatched to a handler per message code on the calling thread.
     """
 
+    # Most datagrams the receiver takes from the sockets in one pass
+    RECEIVE_BATCH = 64
+
     def __init__(self, comms=None, voice="Emma", engine="neural"):
         if comms is None:
             comms = dosa.Comms()
 
         self.comms = comms
-        self.tts = Tts(voice=voice, engine=engine)
         self.last_ping = 0
         self.last_heartbeat = 0
-        self.devices = []
+        self.devices = dosa.DeviceRegistry()
         self.settings = dosa.get_config()
-        self.config = dosa.Config(self.comms)
-        self.history = dosa.MessageLog()
+        cache_size, cache_age = self.get_tts_cache_limits(self.settings)
+        self.tts = Tts(voice=voice, engine=engine,
+                       memory_cache=self.get_setting(["tts", "memory-cache"], 32) * 1024 * 1024,
+                       cache_size=cache_size, cache_age=cache_age)
+        self.config = dosa.Config(self.comms, registry=self.devices)
+
+        # Duplicate suppression of device retransmits
+        self.history = dosa.MessageLog(
+            max_history=self.get_setting(["monitor", "dedupe-size"], 1024),
+            ttl=self.get_setting(["monitor", "dedupe-ttl"], 30),
+        )
 
         # Create a client using the credentials and region defined in the [dosa] section of the AWS credentials
         # file (~/.aws/credentials)
         self.session = Session(profile_name="dosa")
-        self.sns = self.session.client("sns")
+        self.sns = self.session.client("sns", endpoint_url=self.get_setting(["sns", "endpoint"], None))
+
+        # Background SNS publishing
+        self.alerts = AlertDispatcher(
+            self.sns, comms=self.comms,
+            workers=self.get_setting(["sns", "workers"], 4),
+            retries=self.get_setting(["sns", "retries"], 3),
+            coalesce_window=self.get_setting(["sns", "coalesce-window"], 60),
+        )
 
         # -- Settings from config file --
         # Time in seconds between heartbeats
@@ -43,10 +67,100 @@ class SecBot:
         # Vocalise unresponsive device recovery
         self.report_recovery = self.get_setting(["monitor", "report-recovery"], True)
 
+        # Packets received but not yet dispatched, beyond this the oldest are dropped
+        self.inbox = queue.Queue(self.get_setting(["monitor", "inbox-size"], 1024))
+        self.inbox_peak = 0
+        self.received = 0
+        self.dispatched = 0
+        self.dropped = 0
+
+        # The registry is shared between the dispatcher and the scheduler
+        self.devices_lock = threading.Lock()
+
+        # Set to stop the receiver and scheduler, a fault in either is re-raised by the dispatcher
+        self.stopping = threading.Event()
+        self.threads = []
+        self.fault = None
+
+        # Unknown message codes are only logged
+        self.handlers = dosa.HandlerRegistry(default=self.log)
+        self.register_handlers()
+
+        # Modules with extra handlers, each has a register(registry, secbot) function
+        self.handlers.load_plugins(self.get_setting(["plugins"], []), self)
+
+        # Retransmit schedule for messages we need ACK'd
+        retransmit = self.get_setting(["comms", "retransmit"], None)
+        if retransmit is not None:
+            self.comms.retransmit = dosa.RetransmitPolicy(
+                initial_rto=retransmit.get("initial-rto", 0.2),
+                backoff=retransmit.get("backoff", 2.0),
+                max_attempts=retransmit.get("max-attempts", 6),
+                jitter=retransmit.get("jitter", 0.1),
+            )
+
+        # Larger kernel receive buffers absorb trigger bursts from many sensors at once
+        rcvbuf = self.get_setting(["comms", "rcvbuf"], None)
+        if rcvbuf:
+            effective = self.comms.set_rcvbuf(rcvbuf)
+            if effective < rcvbuf:
+                print("Receive buffer limited to " + str(effective) + " bytes, raise net.core.rmem_max for more")
+
         # Log servers
         self.statsd_server = self.get_setting(["logging", "statsd"], {"server": "127.0.0.1", "port": 8125})
         self.log_server = self.get_setting(["logging", "logs"], {"server": "127.0.0.1", "port": 10518})
 
+        # Metrics and logs are batched and sent every flush-interval seconds
+        self.telemetry = Telemetry(
+            statsd=(self.statsd_server["server"], self.statsd_server["port"]),
+            logs=(self.log_server["server"], self.log_server["port"]),
+            prefix="dosa",
+            interval=self.get_setting(["logging", "flush-interval"], 1.0),
+        )
+
+        # Monotonic time of the last ping, for PONG round trip times
+        self.ping_sent_at = None
+
+        # Hot-path instrumentation, off unless enabled as it costs a little on every packet
+        self.metrics_settings = self.get_setting(["metrics"], {})
+        self.metrics = Metrics() if self.metrics_settings.get("enabled", False) else NULL_METRICS
+        self.metrics_server = None
+        self.comms.metrics = self.metrics
+        self.alerts.metrics = self.metrics
+        self.tts.set_metrics(self.metrics)
+        self.dedupe_hits = self.metrics.counter("dedupe_hits_total", "Retransmitted packets suppressed")
+
+        # Message code -> (packet counter, handler time histogram)
+        self.code_metrics = {}
+
+        # (device name, message code) -> statsd metric name
+        self.device_metric_names = {}
+
+    def register_handlers(self):
+        """
+        Register the built-in handler for each message code.
+        """
+        self.handlers.register(dosa.Messages.BEGIN, self.handle_begin_end)
+        self.handlers.register(dosa.Messages.END, self.handle_begin_end)
+        self.handlers.register(dosa.Messages.LOG, self.handle_log)
+        self.handlers.register(dosa.Messages.SEC, self.handle_sec)
+        self.handlers.register(dosa.Messages.FLUSH, self.handle_flush)
+        self.handlers.register(dosa.Messages.TRIGGER, self.handle_trigger)
+        self.handlers.register(dosa.Messages.PLAY, self.handle_play)
+        self.handlers.register(dosa.Messages.PONG, self.handle_pong)
+
+        # Don't log pings or acks
+        self.handlers.ignore(dosa.Messages.PING)
+        self.handlers.ignore(dosa.Messages.ACK)
+
+    @staticmethod
+    def get_tts_cache_limits(settings):
+        """
+        TTS cache size in bytes and age in seconds, from the MB and days in the tts settings.
+        """
+        tts = settings.get("tts", {})
+        return tts.get("cache-size", 256) * 1024 * 1024, tts.get("cache-age", 90) * 86400
+
     def get_setting(self, path, default):
         node = self.settings
         for p in path:
@@ -59,25 +173,136 @@ class SecBot:
 
     def run(self, announce=True):
         print("Security Bot online")
-        self.comms.send(self.comms.build_payload(dosa.Messages.ONLINE))
+        self.comms.send_command(dosa.Messages.ONLINE)
 
         if announce:
             print("Stats server: " + self.statsd_server["server"] + ":" + str(self.statsd_server["port"]))
             print("Log server:   " + self.log_server["server"] + ":" + str(self.log_server["port"]))
-            self.tts.play("DOSA Security Bot online")
+            self.tts.announce("DOSA Security Bot online")
+
+        # Synthesise everything we can predict ahead of time, so the first of each announcement isn't delayed by Polly
+        self.tts.prewarm(self.get_phrases())
+
+        self.stopping.clear()
+        self.fault = None
+        self.telemetry.start()
+
+        if self.metrics.enabled and self.metrics_settings.get("port") is not None:
+            self.metrics_server = MetricsServer(self.metrics, port=self.metrics_settings["port"],
+                                                address=self.metrics_settings.get("address", "127.0.0.1"))
+            self.metrics_server.start()
+        self.start_thread("secbot-receiver", self.run_receiver)
+        self.start_thread("secbot-scheduler", self.run_scheduler)
 
         while True:
+            if self.fault is not None:
+                raise self.fault
+
+            try:
+                packet = self.inbox.get(timeout=1.0)
+            except queue.Empty:
+                continue
+
+            self.dispatch(packet)
+
+    def start_thread(self, name, target):
+        thread = threading.Thread(target=self.run_thread, args=(target,), name=name, daemon=True)
+        thread.start()
+        self.threads.append(thread)
+
+    def run_thread(self, target):
+        """
+        Run a worker loop, recording any exception so the dispatcher can raise it on the main thread.
+        """
+        try:
+            target()
+        except Exception as e:
+            self.fault = e
+            self.stopping.set()
+
+    def run_receiver(self):
+        """
+        Drain the sockets into the inbox, suppressing device retransmits.
+
+        ACKs are resolved here, so handlers waiting on ACKs sleep rather than competing for the sockets.
+        """
+        self.comms.claim_reader()
+        try:
+            while not self.stopping.is_set():
+                for packet in self.comms.receive_batch(self.RECEIVE_BATCH, timeout=0.5):
+                    if self.history.check(packet.addr, packet.msg_id):
+                        self.dedupe_hits.inc()
+                        continue
+
+                    self.received += 1
+                    while True:
+                        try:
+                            self.inbox.put_nowait(packet)
+                            break
+                        except queue.Full:
+                            try:
+                                self.inbox.get_nowait()
+                                self.dropped += 1
+                            except queue.Empty:
+                                pass
+
+                self.inbox_peak = max(self.inbox_peak, self.inbox.qsize())
+        finally:
+            self.comms.release_reader()
+
+    def run_scheduler(self):
+        """
+        Heartbeats, pings, device staleness and alert summaries, independent of how long packet handlers take.
+        """
+        while not self.stopping.is_set():
             self.do_heartbeat()
             self.check_devices()
-            self.check_for_packets()
+            self.alerts.flush()
+            self.stopping.wait(self.get_idle_timeout())
+
+    def get_stats(self):
+        """
+        Queue depths and packet counters.
+        """
+        stats = {
+            "inbox": self.inbox.qsize(),
+            "inbox-peak": self.inbox_peak,
+            "received": self.received,
+            "dispatched": self.dispatched,
+            "dropped": self.dropped,
+            "tts": self.tts.pending(),
+            "alerts": self.alerts.queue.qsize(),
+        }
+
+        kernel_drops = self.comms.kernel_drops()
+        if kernel_drops is not None:
+            stats["kernel-drops"] = kernel_drops
+
+        return stats
+
+    def get_idle_timeout(self):
+        """
+        Time in seconds we can block waiting for packets before a heartbeat or ping falls due.
+
+        Capped at one second, which is the resolution device staleness is checked at.
+        """
+        # Tasks are due once a whole second past their interval, measure against the fractional clock so we sleep
+        # until then rather than spinning through the second in which they aren't yet due
+        next_task = min(self.last_heartbeat + self.heartbeat_interval, self.last_ping + self.ping_interval) + 1
+        return min(max(next_task - time.time(), 0), 1.0)
 
     def do_heartbeat(self):
         ct = self.get_current_time()
 
         # Send a heartbeat if we're stale
         if ct - self.last_heartbeat > self.heartbeat_interval:
-            self.comms.send("dosa.secbot.heartbeat:1|c".encode(),
-                            (self.statsd_server["server"], self.statsd_server["port"]))
+            self.telemetry.incr("secbot.heartbeat")
+            for name, value in self.get_stats().items():
+                self.telemetry.gauge("secbot." + name, value)
+
+            if self.metrics.enabled and self.metrics_settings.get("statsd", False):
+                self.metrics.publish(self.telemetry)
+
             self.last_heartbeat = ct
 
     def check_devices(self):
@@ -91,176 +316,267 @@ class SecBot:
 
         # Send a ping if we're stale
         if ct - self.last_ping > self.ping_interval:
-            self.comms.send(self.comms.build_payload(dosa.Messages.PING))
+            self.comms.send_command(dosa.Messages.PING)
+            self.ping_sent_at = time.monotonic()
             self.last_ping = ct
 
-        for d in self.devices:
-            if not d.reported_unresponsive and d.is_stale(self.device_timeout):
-                # Device is now unresponsive!
-                d.reported_unresponsive = True
-
-                # Create a log of this -
-                self.comms.net_log(
-                    dosa.LogLevel.ERROR,
-                    "Device unresponsive: " + d.device_name + " at " + d.address[0] + ":" + str(d.address[1])
-                )
+        # Flag newly unresponsive devices under the same lock the receiver uses to clear the flag on recovery
+        unresponsive = []
+        with self.devices_lock:
+            for d in self.devices.pop_stale(self.device_timeout):
+                if not d.reported_unresponsive:
+                    d.reported_unresponsive = True
+                    unresponsive.append(d)
+
+        for d in unresponsive:
+            # Device is now unresponsive!
+            # Create a log of this -
+            self.comms.net_log(
+                dosa.LogLevel.ERROR,
+                "Device unresponsive: " + d.device_name + " at " + d.address[0] + ":" + str(d.address[1])
+            )
+
+            # Vocalise an alert -
+            self.tts.announce("Alert, " + d.device_name + " is not responding", Priority.ALERT)
+
+            # Raise an incident -
+            self.alert(
+                d.device_name, d.device_name + " is not responding",
+                category=dosa.AlertCategory.NETWORK,
+                level=dosa.LogLevel.as_string(dosa.LogLevel.ERROR)
+            )
+
+    def check_for_packets(self, timeout=0.1):
+        """
+        Check for and process incoming traffic, for use when not running the receiver thread.
+        """
+        packet = self.comms.receive(timeout=timeout)
+        if packet is None:
+            return
 
-                # Vocalise an alert -
-                self.tts.play("Alert, " + d.device_name + " is not responding")
+        if self.history.check(packet.addr, packet.msg_id):
+            self.dedupe_hits.inc()
+            return
 
-                # Raise an incident -
-                self.alert(
-                    d.device_name, d.device_name + " is not responding",
-                    category=dosa.AlertCategory.NETWORK,
-                    level=dosa.LogLevel.as_string(dosa.LogLevel.ERROR)
-                )
+        self.dispatch(packet)
 
-    def check_for_packets(self):
+    def dispatch(self, packet):
         """
-        Check for and process incoming traffic.
+        Pass a packet to the handlers for its message code.
         """
-        packet = self.comms.receive(timeout=0.1)
-        if packet is None:
+        self.dispatched += 1
+
+        # Handlers are found by the raw code, the decoded form is only needed the first time a device sends it
+        key = (packet.device_name, packet.msg_code)
+        name = self.device_metric_names.get(key)
+        if name is None:
+            name = self.device_metric_names[key] = self.telemetry.metric_name(
+                "device", packet.device_name, packet.msg_code.decode()
+            )
+        self.telemetry.incr(name)
+
+        if not self.metrics.enabled:
+            self.handlers.dispatch(packet)
             return
 
-        device = dosa.Device(msg=packet)
-        if self.history.validate(device, packet.msg_id):
+        instruments = self.code_metrics.get(packet.msg_code)
+        if instruments is None:
+            instruments = self.code_metrics[packet.msg_code] = (
+                self.metrics.counter("packets_received_total", "Packets dispatched, by message code",
+                                     code=packet.msg_code.decode()),
+                self.metrics.histogram("handler_seconds", "Time spent handling packets, by message code",
+                                       code=packet.msg_code.decode()),
+            )
+
+        instruments[0].inc()
+        with instruments[1].time():
+            self.handlers.dispatch(packet)
+
+    def announce(self, msg, priority=Priority.NOTICE):
+        print(msg)
+        self.tts.announce(msg, priority)
+
+    def handle_begin_end(self, packet):
+        # These commands we'll ack but otherwise won't do anything special with them
+        self.comms.send_ack(packet.msg_id_bytes(), packet.addr)
+        self.log(packet)
+
+    def handle_log(self, packet):
+        # For log messages, we'll hunt down any error or critical messages and raise alerts
+        log_level = packet.body.level
+        log_message = packet.body.message
+        aux = " | " + dosa.LogLevel.as_string(log_level) + " | " + log_message
+
+        # Send an ack for all log messages
+        self.comms.send_ack(packet.msg_id_bytes(), packet.addr)
+
+        # Debug messages go no further, we won't log or action them
+        if log_level == dosa.LogLevel.DEBUG:
             return
 
-        msg = ""
-
-        if packet.msg_code == dosa.Messages.BEGIN or packet.msg_code == dosa.Messages.BEGIN:
-            # These commands we'll ack but otherwise won't do anything special with them
-            self.comms.send_ack(packet.msg_id_bytes(), packet.addr)
-            self.log(packet)
-
-        elif packet.msg_code == dosa.Messages.LOG:
-            # For log messages, we'll hunt down any error or critical messages and raise alerts
-            log_level = struct.unpack("<B", packet.payload[27:28])[0]
-            log_message = packet.payload[28:packet.payload_size].decode("utf-8")
-            aux = " | " + dosa.LogLevel.as_string(log_level) + " | " + log_message
-
-            # Send an ack for all log messages
-            self.comms.send_ack(packet.msg_id_bytes(), packet.addr)
-
-            # Debug messages go no further, we won't log or action them
-            if log_level == dosa.LogLevel.DEBUG:
-                return
-
-            # Forward to log server
-            self.log(packet, aux)
-
-            # Do not raise incidents for, or vocalise own error messages
-            if device.device_name == self.comms.device_name.decode("utf-8"):
-                return
-
-            if log_level == dosa.LogLevel.CRITICAL:
-                msg = "Warning, " + packet.device_name + " critical. " + log_message + "."
-            elif log_level == dosa.LogLevel.ERROR:
-                msg = "Warning, " + packet.device_name + " error. " + log_message + "."
-
-            if msg:
-                # Raise an incident for this log message
-                self.alert(
-                    packet.device_name,
-                    packet.device_name + " critical",
-                    category=dosa.AlertCategory.NETWORK,
-                    level=dosa.LogLevel.as_string(log_level)
-                )
+        # Forward to log server
+        self.log(packet, aux)
 
-        elif packet.msg_code == dosa.Messages.SEC:
-            # Security messages require an alert raised
-            sec_level = struct.unpack("<B", packet.payload[27:28])[0]
-            aux = " | " + dosa.SecurityLevel.as_string(sec_level)
-            self.log(packet, aux)
-            self.comms.send_ack(packet.msg_id_bytes(), packet.addr)
-
-            if sec_level == dosa.SecurityLevel.ALERT:
-                msg = "Security alert, " + packet.device_name + ", activity"
-            elif sec_level == dosa.SecurityLevel.BREACH:
-                msg = "Security alert, " + packet.device_name + ", breach"
-            elif sec_level == dosa.SecurityLevel.TAMPER:
-                msg = "Security alert, " + packet.device_name + ", tamper warning"
-            elif sec_level == dosa.SecurityLevel.PANIC:
-                msg = "Security alert, " + packet.device_name + ", panic alarm triggered"
-
-            self.alert(packet.device_name, msg, category=dosa.AlertCategory.SECURITY,
-                       level=dosa.SecurityLevel.as_string(sec_level))
-
-        elif packet.msg_code == dosa.Messages.FLUSH:
-            # Net flush - we'll dump our device registry in-line with flush protocol
-            msg = "Network flush initiated by " + packet.device_name
-            self.log(packet)
-            self.devices.clear()
-            self.last_ping = 0
-
-        elif packet.msg_code == dosa.Messages.TRIGGER:
-            # Trigger messages may contain information about the trigger parameters, decode them and add to log msg
-            trigger_type = struct.unpack("<B", packet.payload[27:28])[0]
-            if trigger_type == 0:
-                self.log(packet, " | UNKNOWN")
-            elif trigger_type == 1:
-                self.log(packet, " | BUTTON")
-            elif trigger_type == 2:
-                self.log(packet, " | SENSOR")
-            elif trigger_type == 3:
-                # Ranging sensor, show distances
-                dist_prev = struct.unpack("<H", packet.payload[28:30])[0]
-                dist_new = struct.unpack("<H", packet.payload[30:32])[0]
-                self.log(packet, " | RANGE | " + str(dist_prev) + " | " + str(dist_new))
-            elif trigger_type == 4:
-                # IR grid map - could log some data here, but probably too much for a single-line logfile
-                self.log(packet, " | MAP")
-            elif trigger_type == 100:
-                self.log(packet, " | AUTO")
-
-        elif packet.msg_code == dosa.Messages.PLAY:
-            # A device has requested a play be run, we're responsible for that
-            self.comms.send_ack(packet.msg_id_bytes(), packet.addr)
-            play = packet.payload[27:packet.payload_size].decode("utf-8")
-            self.log(packet, " | " + play)
-            self.run_play(play)
-
-        elif packet.msg_code == dosa.Messages.PONG:
-            # Ignore ping/pong messages in logs, but register/update device details when we see a pong
-            match = False
-            for d in self.devices:
-                if d.address == device.address:
-                    match = True
-                    d.pong()
-                    if d.reported_unresponsive:
-                        # device recovery
-                        d.reported_unresponsive = False
-                        self.comms.net_log(dosa.LogLevel.WARNING, "Device recovery: " + d.device_name)
-                        if self.report_recovery:
-                            msg = "Notice, " + d.device_name + " is back online"
-                    break
-
-            if not match:
-                device.device_type = packet.payload[self.comms.BASE_PAYLOAD_SIZE]
-                device.device_state = packet.payload[self.comms.BASE_PAYLOAD_SIZE + 1]
-                self.devices.append(device)
-                print("Found device: " + device.device_name)
-
-        elif packet.msg_code == dosa.Messages.PING or packet.msg_code == dosa.Messages.ACK:
-            # Don't log pings or acks
-            pass
+        # Do not raise incidents for, or vocalise own error messages
+        if packet.device_name == self.comms.device_name.decode("utf-8"):
+            return
 
+        if log_level == dosa.LogLevel.CRITICAL:
+            msg = "Warning, " + packet.device_name + " critical. " + log_message + "."
+        elif log_level == dosa.LogLevel.ERROR:
+            msg = "Warning, " + packet.device_name + " error. " + log_message + "."
         else:
-            self.log(packet)
+            return
 
+        # Raise an incident for this log message
+        self.alert(
+            packet.device_name,
+            packet.device_name + " critical",
+            category=dosa.AlertCategory.NETWORK,
+            level=dosa.LogLevel.as_string(log_level)
+        )
+        self.announce(msg, Priority.ALERT)
+
+    def handle_sec(self, packet):
+        # Security messages require an alert raised
+        sec_level = packet.body.level
+        aux = " | " + dosa.SecurityLevel.as_string(sec_level)
+        self.log(packet, aux)
+        self.comms.send_ack(packet.msg_id_bytes(), packet.addr)
+
+        msg = self.get_security_phrase(packet.device_name, sec_level)
+        self.alert(packet.device_name, msg, category=dosa.AlertCategory.SECURITY,
+                   level=dosa.SecurityLevel.as_string(sec_level))
         if msg:
-            print(msg)
-            self.tts.play(msg, wait=False)
+            self.announce(msg, Priority.SECURITY)
+
+    def handle_flush(self, packet):
+        # Net flush - we'll dump our device registry in-line with flush protocol
+        self.log(packet)
+        with self.devices_lock:
+            self.devices.clear()
+        self.last_ping = 0
+        self.announce("Network flush initiated by " + packet.device_name)
+
+    def handle_trigger(self, packet):
+        # Trigger messages may contain information about the trigger parameters, decode them and add to log msg
+        trigger = packet.body
+        if trigger.trigger_type == dosa.TriggerType.RANGING:
+            # Ranging sensor, show distances
+            self.log(packet, " | RANGE | " + str(trigger.dist_prev) + " | " + str(trigger.dist_new))
+        else:
+            # IR grid map - could log some data here, but probably too much for a single-line logfile
+            self.log(packet, " | " + dosa.TriggerType.as_string(trigger.trigger_type))
+
+    def handle_play(self, packet):
+        # A device has requested a play be run, we're responsible for that
+        self.comms.send_ack(packet.msg_id_bytes(), packet.addr)
+        play = packet.body.play
+        self.log(packet, " | " + play)
+        self.run_play(play)
+
+    def handle_pong(self, packet):
+        # Ignore ping/pong messages in logs, but register/update device details when we see a pong
+        if self.ping_sent_at is not None and time.monotonic() - self.ping_sent_at < self.ping_interval:
+            self.telemetry.timing(self.telemetry.metric_name("device", packet.device_name, "ping"),
+                                  time.monotonic() - self.ping_sent_at)
+
+        with self.devices_lock:
+            d = self.devices.get(packet.addr)
+            if d is not None:
+                self.devices.touch(d)
+                recovered = d.reported_unresponsive
+                d.reported_unresponsive = False
+            else:
+                device = dosa.Device(msg=packet)
+                device.device_type = packet.body.device_type
+                device.device_state = packet.body.device_state
+                self.devices.add(device)
+
+        if d is None:
+            self.tts.prewarm(self.get_device_phrases(device.device_name))
+            print("Found device: " + device.device_name)
+
+        elif recovered:
+            # device recovery
+            self.comms.net_log(dosa.LogLevel.WARNING, "Device recovery: " + d.device_name)
+            if self.report_recovery:
+                self.announce("Notice, " + d.device_name + " is back online")
+
+    def populate_tts_cache(self, scan_time=3.0):
+        """
+        Synthesise every predictable announcement into the TTS cache, including those for devices that answer a ping.
+
+        Returns the number of phrases that failed to synthesise.
+        """
+        # Discovery uses a Scanner rather than check_for_packets, so no handlers or plays are run by the scan
+        phrases = self.get_phrases()
+        for device in dosa.Scanner(self.comms, max_time=scan_time).scan():
+            phrases += self.get_device_phrases(device.device_name)
+
+        failed = 0
+        for future in self.tts.prewarm(phrases):
+            # Tts.warm reports its own errors and returns False, rather than raising
+            if not future.result():
+                failed += 1
+
+        return failed
+
+    def get_phrases(self):
+        """
+        Announcements that can be predicted ahead of time, for TTS pre-warming.
+        """
+        phrases = ["DOSA Security Bot online"]
+
+        for play in self.get_setting(["plays"], {}).values():
+            for action in play.get("actions", []):
+                if action.get("action") == "announce" and "value" in action:
+                    phrases.append(action["value"])
+
+        with self.devices_lock:
+            names = [device.device_name for device in self.devices]
+
+        for name in names:
+            phrases += self.get_device_phrases(name)
+
+        return phrases
+
+    def get_device_phrases(self, device_name):
+        """
+        Announcements that may be made about a single device.
+        """
+        phrases = ["Alert, " + device_name + " is not responding"]
+
+        if self.report_recovery:
+            phrases.append("Notice, " + device_name + " is back online")
+
+        for sec_level in (dosa.SecurityLevel.ALERT, dosa.SecurityLevel.BREACH, dosa.SecurityLevel.TAMPER,
+                          dosa.SecurityLevel.PANIC):
+            phrases.append(self.get_security_phrase(device_name, sec_level))
+
+        return phrases
+
+    @staticmethod
+    def get_security_phrase(device_name, sec_level):
+        if sec_level == dosa.SecurityLevel.ALERT:
+            return "Security alert, " + device_name + ", activity"
+        elif sec_level == dosa.SecurityLevel.BREACH:
+            return "Security alert, " + device_name + ", breach"
+        elif sec_level == dosa.SecurityLevel.TAMPER:
+            return "Security alert, " + device_name + ", tamper warning"
+        elif sec_level == dosa.SecurityLevel.PANIC:
+            return "Security alert, " + device_name + ", panic alarm triggered"
+        else:
+            return ""
 
     def log(self, msg, aux=""):
         """
-        Send a log to the log server.
+        Queue a log for the log server.
         """
-        t = time.strftime("%H:%M:%S", time.localtime())
-        payload = t + " [" + str(msg.msg_id).rjust(5, ' ') + "] " + msg.addr[0] + ":" + str(
-            msg.addr[1]) + " (" + msg.device_name + "): " + msg.msg_code.decode("utf-8").upper() + aux
-        self.comms.send(payload.encode(), (self.log_server["server"], self.log_server["port"]))
+        self.telemetry.log(
+            self.telemetry.timestamp() + " [" + str(msg.msg_id).rjust(5, ' ') + "] " + msg.addr[0] + ":" +
+            str(msg.addr[1]) + " (" + msg.device_name + "): " + msg.msg_code.decode("utf-8").upper() + aux
+        )
 
     def alert(self, device, msg, category, level, tags=None):
         """
@@ -279,29 +595,8 @@ class SecBot:
         if category not in self.settings["alerts"]:
             return
 
-        sns_tags = {}
-        for key, value in tags.items():
-            sns_tags[key] = {"DataType": "String", "StringValue": value}
-
-        for arn in self.settings["alerts"][category]:
-            try:
-                self.sns.publish(
-                    TargetArn=arn,
-                    Message=json.dumps({'default': msg}),
-                    MessageStructure='json',
-                    MessageAttributes=sns_tags,
-                )
-
-                print(category + " alert dispatched to " + arn)
-                self.comms.net_log(
-                    dosa.LogLevel.WARNING,
-                    category + " alert dispatched to " + arn
-                )
-            except ClientError:
-                self.comms.net_log(
-                    dosa.LogLevel.ERROR,
-                    "SecBot failed to sent alert for device " + device
-                )
+        # Published in the background by the alert dispatcher
+        self.alerts.submit(device, msg, category, self.settings["alerts"][category], tags, level)
 
     def run_play(self, play):
         """
@@ -332,31 +627,62 @@ class SecBot:
             self.run_action_set_lock(action["devices"], action["value"])
 
     def run_action_announce(self, msg):
-        self.tts.play(msg)
+        self.tts.announce(msg)
 
     def run_action_set_lock(self, devices, value):
         if value < 0 or value > 3:
             self.comms.net_log(dosa.LogLevel.WARNING, "Bad lock state in play: " + str(value))
             return
 
+        # Send to every target first and then wait on all of the ACKs together
+        lock_payload = self.config.pack_lock_state(value)
+        requests = []
         for device in devices:
+            with self.devices_lock:
+                targets = list(self.devices.find(device))
+
             found = False
-            for reg_device in self.devices:
-                if reg_device.device_name == device:
-                    found = True
-                    if self.config.exec_lock_state(reg_device, value):
-                        self.comms.net_log(
-                            dosa.LogLevel.INFO,
-                            "Set " + device + " to lock state " + dosa.LockLevel.as_string(value)
-                        )
-                    else:
-                        msg = "Failed to set " + device + " to lock state " + dosa.LockLevel.as_string(value)
-                        self.comms.net_log(dosa.LogLevel.ERROR, msg)
-                        self.tts.play("Error executing play: " + msg)
+            for reg_device in targets:
+                found = True
+                payload = self.comms.build_payload(dosa.Messages.CONFIG_SETTING, lock_payload)
+                requests.append((device, self.comms.send_pending(payload, reg_device.address)))
 
             if not found:
                 self.comms.net_log(dosa.LogLevel.WARNING, "Unknown device in play: " + device)
-                self.tts.play("Unknown device in play: " + device)
+                self.tts.announce("Unknown device in play: " + device, Priority.ALERT)
+
+        self.comms.wait_for_acks([pending for _, pending in requests])
+
+        for device, pending in requests:
+            if pending.acked:
+                self.telemetry.timing(self.telemetry.metric_name("device", device, "ack"), pending.latency)
+                self.comms.net_log(
+                    dosa.LogLevel.INFO,
+                    "Set " + device + " to lock state " + dosa.LockLevel.as_string(value) +
+                    " (ack in " + str(round(pending.latency * 1000)) + " ms)"
+                )
+            else:
+                msg = "Failed to set " + device + " to lock state " + dosa.LockLevel.as_string(value)
+                self.comms.net_log(dosa.LogLevel.ERROR, msg)
+                self.tts.announce("Error executing play: " + msg, Priority.ALERT)
+
+    def stop(self):
+        """
+        Stop background workers and release the network sockets.
+        """
+        self.stopping.set()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+            self.metrics_server = None
+
+        self.tts.stop()
+        self.alerts.stop()
+        self.telemetry.stop()
+        self.comms.close()
 
     @staticmethod
     def get_current_time():
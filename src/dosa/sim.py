@@ -0,0 +1,365 @@
+import heapq
+import ipaddress
+import random
+import selectors
+import socket
+import struct
+import threading
+import time
+
+import dosa
+from dosa.comms import PacketBuilder
+from dosa.exc import NotDosaPacketException
+
+
+class SimDevice:
+    """
+    A virtual device with its own socket, so the traffic it sends comes from its own address.
+    """
+
+    def __init__(self, name, address, device_type=dosa.DeviceType.IR_PASSIVE, device_state=dosa.DeviceStatus.OK):
+        self.name = name
+        self.address = address
+        self.device_type = device_type
+        self.device_state = device_state
+        self.builder = PacketBuilder(name.encode())
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(address)
+        self.sock.setblocking(False)
+
+        # msg_id -> [payload, target, next send, sends remaining] for messages awaiting an ACK
+        self.unacked = {}
+
+    def close(self):
+        self.sock.close()
+
+
+class SimFleet:
+    """
+    A fleet of virtual devices for load testing SecBot, Monitor and the tools without hardware.
+
+    Devices are bound to consecutive addresses from `base_address`, which on Linux may be anywhere in 127.0.0.0/8.
+    Devices answer PINGs, sent to them or to the multicast group, with PONGs, and ACK configuration requests. They send
+    triggers, logs and security alerts to `target` at random with the given mean rate per device per second. Logs and
+    alerts are retransmitted until ACK'd, as the firmware does, which exercises retransmit suppression. A share of
+    triggers are IR grid triggers carrying an 8x8 map.
+
+    Multicast sent from a loopback address doesn't reach other sockets, so `target` is unicast by default, and is
+    normally the address the program under test listens on.
+    """
+
+    DEVICE_TYPES = (dosa.DeviceType.IR_PASSIVE, dosa.DeviceType.IR_ACTIVE, dosa.DeviceType.SONAR,
+                    dosa.DeviceType.BUTTON, dosa.DeviceType.MOTOR)
+
+    RETRY_INTERVAL = 0.2
+
+    def __init__(self, count=10, base_address="127.0.0.10", port=6901, target=("127.0.0.1", 6901),
+                 trigger_rate=0.1, log_rate=0.01, sec_rate=0.001, ir_grid_share=0.25, retries=5, listen_multicast=True,
+                 seed=None):
+        self.target = target
+        self.rates = {
+            dosa.Messages.TRIGGER: trigger_rate,
+            dosa.Messages.LOG: log_rate,
+            dosa.Messages.SEC: sec_rate,
+        }
+        self.ir_grid_share = ir_grid_share
+        self.retries = retries
+        self.random = random.Random(seed)
+
+        base = ipaddress.ip_address(base_address)
+        self.devices = []
+        for i in range(count):
+            device_type = self.DEVICE_TYPES[i % len(self.DEVICE_TYPES)]
+            self.devices.append(SimDevice("Sim Device " + str(i + 1).zfill(3), (str(base + i), port), device_type))
+
+        self.addresses = set(d.address for d in self.devices)
+
+        self.selector = selectors.DefaultSelector()
+        for device in self.devices:
+            self.selector.register(device.sock, selectors.EVENT_READ, device)
+
+        # Pings to the group reach a single listener, which answers for every device
+        self.mc_sock = None
+        if listen_multicast:
+            self.mc_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+            self.mc_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.mc_sock.bind((dosa.Comms.MULTICAST_GROUP, dosa.Comms.MULTICAST_PORT))
+            self.mc_sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, struct.pack(
+                "4sl", socket.inet_aton(dosa.Comms.MULTICAST_GROUP), socket.INADDR_ANY))
+            self.mc_sock.setblocking(False)
+            self.selector.register(self.mc_sock, selectors.EVENT_READ, None)
+
+        # (time, sequence, device, message code) of the next spontaneous message from each device and code
+        self.schedule = []
+        self.sequence = 0
+
+        self.sent = 0
+        self.received = 0
+        self.acks = 0
+        self.retransmits = 0
+
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def start(self):
+        now = time.monotonic()
+        for device in self.devices:
+            for code in self.rates:
+                self.schedule_next(now, device, code)
+
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run, name="sim-fleet", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is not None:
+            self.stopping.set()
+            self.thread.join()
+            self.thread = None
+
+        self.selector.close()
+        for device in self.devices:
+            device.close()
+        if self.mc_sock is not None:
+            self.mc_sock.close()
+
+    def schedule_next(self, now, device, code):
+        if self.rates[code] <= 0:
+            return
+
+        self.sequence += 1
+        heapq.heappush(self.schedule, (now + self.random.expovariate(self.rates[code]), self.sequence, device, code))
+
+    def run(self):
+        while not self.stopping.is_set():
+            now = time.monotonic()
+            wake = now + 0.1
+            if self.schedule:
+                wake = min(wake, self.schedule[0][0])
+
+            for key, _ in self.selector.select(max(0.0, wake - now)):
+                self.read(key.fileobj, key.data)
+
+            now = time.monotonic()
+            while self.schedule and self.schedule[0][0] <= now:
+                _, _, device, code = heapq.heappop(self.schedule)
+                self.emit(device, code)
+                self.schedule_next(now, device, code)
+
+            self.retransmit(now)
+
+    def read(self, sock, device):
+        """
+        Handle a datagram to one device, or to the multicast group if `device` is None.
+        """
+        try:
+            packet, addr = sock.recvfrom(10240)
+        except (BlockingIOError, InterruptedError):
+            return
+
+        if addr in self.addresses:
+            return
+
+        try:
+            msg = dosa.Message(packet, addr)
+        except NotDosaPacketException:
+            return
+
+        self.received += 1
+        for target in (self.devices if device is None else (device,)):
+            self.respond(target, msg)
+
+    def respond(self, device, msg):
+        if msg.msg_code == dosa.Messages.PING:
+            self.send(device, device.builder.build(dosa.Messages.PONG,
+                                                   struct.pack("<BB", device.device_type, device.device_state)),
+                      msg.addr)
+
+        elif msg.msg_code in (dosa.Messages.CONFIG_SETTING, dosa.Messages.REQUEST_BT_CFG_MODE):
+            self.send(device, device.builder.build(dosa.Messages.ACK, msg.msg_id_bytes()), msg.addr)
+
+        elif msg.msg_code == dosa.Messages.ACK:
+            if device.unacked.pop(msg.body.ack_id, None) is not None:
+                self.acks += 1
+
+    def emit(self, device, code):
+        """
+        Send a spontaneous trigger, log or security alert from a device.
+        """
+        if code == dosa.Messages.TRIGGER:
+            if self.random.random() < self.ir_grid_share:
+                aux = struct.pack("<B", dosa.TriggerType.IR_GRID) + bytes(
+                    self.random.randrange(0, 50) for _ in range(64))
+            else:
+                aux = struct.pack("<BHH", dosa.TriggerType.RANGING, self.random.randrange(200, 2000),
+                                  self.random.randrange(200, 2000))
+
+            self.send(device, device.builder.build(code, aux), self.target)
+            return
+
+        if code == dosa.Messages.LOG:
+            level = self.random.choice((dosa.LogLevel.INFO, dosa.LogLevel.WARNING, dosa.LogLevel.ERROR))
+            aux = struct.pack("<B", level) + b"Simulated " + dosa.LogLevel.as_string(level).lower().encode()
+        else:
+            aux = struct.pack("<B", self.random.choice((dosa.SecurityLevel.ALERT, dosa.SecurityLevel.BREACH)))
+
+        payload = device.builder.build(code, aux)
+        self.send(device, payload, self.target)
+
+        if self.retries > 0:
+            msg_id = struct.unpack("<H", payload[0:2])[0]
+            device.unacked[msg_id] = [payload, self.target, time.monotonic() + self.RETRY_INTERVAL, self.retries]
+
+    def retransmit(self, now):
+        for device in self.devices:
+            if not device.unacked:
+                continue
+
+            for msg_id, entry in list(device.unacked.items()):
+                if entry[2] > now:
+                    continue
+
+                self.send(device, entry[0], entry[1])
+                self.retransmits += 1
+                entry[2] = now + self.RETRY_INTERVAL
+                entry[3] -= 1
+                if entry[3] <= 0:
+                    del device.unacked[msg_id]
+
+    def send(self, device, payload, addr):
+        try:
+            device.sock.sendto(payload, addr)
+            self.sent += 1
+        except OSError as e:
+            print("Sim send from " + device.name + " failed: " + str(e))
+
+
+# Capture file: magic, then per packet a record header followed by the packet. The header holds the address
+# family, 4 (IPv4, zero padded) or 6 (IPv6), ahead of the source address
+CAPTURE_MAGIC = b"DOSACAP2"
+CAPTURE_RECORD = struct.Struct("<dB16sHH")
+
+# Captures from before IPv6 sources were recorded
+CAPTURE_MAGIC_V1 = b"DOSACAP1"
+CAPTURE_RECORD_V1 = struct.Struct("<d4sHH")
+
+
+class Recorder:
+    """
+    Records DOSA traffic to a capture file, with each packet's arrival time and source address.
+    """
+
+    def __init__(self, comms=None):
+        if comms is None:
+            comms = dosa.Comms()
+
+        self.comms = comms
+        self.recorded = 0
+
+    def record(self, path, duration=None, count=None):
+        """
+        Record until `duration` seconds have passed or `count` packets are captured, or forever if neither is given.
+        """
+        start = time.monotonic()
+        deadline = None if duration is None else start + duration
+
+        with open(path, "wb") as file:
+            file.write(CAPTURE_MAGIC)
+
+            while count is None or self.recorded < count:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+
+                msg = self.comms.receive(timeout=remaining)
+                if msg is None:
+                    continue
+
+                packet = bytes(msg.payload)
+                family = socket.AF_INET6 if ":" in msg.addr[0] else socket.AF_INET
+                file.write(CAPTURE_RECORD.pack(time.monotonic() - start, 6 if family == socket.AF_INET6 else 4,
+                                               socket.inet_pton(family, msg.addr[0]), msg.addr[1], len(packet)))
+                file.write(packet)
+                self.recorded += 1
+
+
+def read_capture(path):
+    """
+    Generator of (seconds since capture start, (ip, port), packet) for every packet in a capture file.
+    """
+    with open(path, "rb") as file:
+        magic = file.read(len(CAPTURE_MAGIC))
+        if magic not in (CAPTURE_MAGIC, CAPTURE_MAGIC_V1):
+            raise dosa.DosaException("Not a DOSA capture file: " + str(path))
+
+        record = CAPTURE_RECORD if magic == CAPTURE_MAGIC else CAPTURE_RECORD_V1
+
+        while True:
+            header = file.read(record.size)
+            if len(header) < record.size:
+                return
+
+            if magic == CAPTURE_MAGIC_V1:
+                offset, ip, port, size = record.unpack(header)
+                yield offset, (socket.inet_ntoa(ip), port), file.read(size)
+                continue
+
+            offset, family, ip, port, size = record.unpack(header)
+            if family == 6:
+                yield offset, (socket.inet_ntop(socket.AF_INET6, ip), port), file.read(size)
+            else:
+                yield offset, (socket.inet_ntop(socket.AF_INET, ip[:4]), port), file.read(size)
+
+
+class Replayer:
+    """
+    Replays a capture file to `target`, at the original pace scaled by `speed`, or as fast as possible if speed is 0.
+
+    Each source address in the capture is replayed from its own loopback address from `base_address`, so per-device
+    behaviour such as retransmit suppression is preserved. IPv6 sources are replayed from IPv4 loopback addresses
+    the same way.
+    """
+
+    def __init__(self, target=("127.0.0.1", 6901), base_address="127.0.1.1", speed=1.0):
+        self.target = target
+        self.base = ipaddress.ip_address(base_address)
+        self.speed = speed
+        self.socks = {}
+
+        self.sent = 0
+        self.elapsed = 0
+
+    def get_sock(self, addr):
+        sock = self.socks.get(addr)
+        if sock is None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind((str(self.base + len(self.socks)), addr[1]))
+            self.socks[addr] = sock
+
+        return sock
+
+    def replay(self, path):
+        """
+        Send every packet in a capture, returns the packets sent per second.
+        """
+        start = time.monotonic()
+
+        try:
+            for offset, addr, packet in read_capture(path):
+                if self.speed > 0:
+                    delay = start + offset / self.speed - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+
+                self.get_sock(addr).sendto(packet, self.target)
+                self.sent += 1
+        finally:
+            for sock in self.socks.values():
+                sock.close()
+            self.socks = {}
+
+        self.elapsed = time.monotonic() - start
+        return self.sent / self.elapsed if self.elapsed > 0 else 0
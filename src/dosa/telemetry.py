@@ -0,0 +1,153 @@
+import re
+import socket
+import threading
+import time
+
+
+class Telemetry:
+    """
+    Buffers statsd metrics and log lines, sending them in batches from a background thread.
+
+    Counters are summed between flushes, so a storm of events costs one line per counter rather than one datagram per
+    event. Lines are packed into datagrams of up to MAX_DATAGRAM bytes, one metric or log line per row. Timers and log
+    lines beyond `max_lines` per flush are dropped and counted in the "telemetry.dropped" counter.
+    """
+
+    # Ethernet MTU less IPv4 and UDP headers
+    MAX_DATAGRAM = 1472
+
+    def __init__(self, statsd=None, logs=None, prefix="dosa", interval=1.0, max_lines=2048):
+        self.statsd = statsd
+        self.logs = logs
+        self.prefix = prefix
+        self.interval = interval
+        self.max_lines = max_lines
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.timers = []
+        self.log_lines = []
+        self.dropped = 0
+
+        self.stamp_time = None
+        self.stamp = ""
+
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def incr(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+
+    def timing(self, name, seconds):
+        with self.lock:
+            if len(self.timers) < self.max_lines:
+                self.timers.append(name + ":" + str(round(seconds * 1000, 2)) + "|ms")
+            else:
+                self.dropped += 1
+
+    def log(self, line):
+        with self.lock:
+            if len(self.log_lines) < self.max_lines:
+                self.log_lines.append(line)
+            else:
+                self.dropped += 1
+
+    def timestamp(self):
+        """
+        Local time as HH:MM:SS, formatted at most once a second.
+        """
+        now = int(time.time())
+        if now != self.stamp_time:
+            self.stamp_time = now
+            self.stamp = time.strftime("%H:%M:%S", time.localtime(now))
+
+        return self.stamp
+
+    @staticmethod
+    def metric_name(*parts):
+        """
+        Join name parts with dots, replacing anything statsd can't carry in a name (eg spaces in device names).
+        """
+        return ".".join(re.sub(r"[^a-z0-9_-]+", "_", str(part).lower()) for part in parts)
+
+    def start(self):
+        if self.thread is not None:
+            return
+
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run_worker, name="telemetry", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop the flush thread after a final flush.
+        """
+        if self.thread is not None:
+            self.stopping.set()
+            self.thread.join()
+            self.thread = None
+
+        self.flush()
+        self.sock.close()
+
+    def run_worker(self):
+        while not self.stopping.wait(self.interval):
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            counters, self.counters = self.counters, {}
+            gauges, self.gauges = self.gauges, {}
+            timers, self.timers = self.timers, []
+            log_lines, self.log_lines = self.log_lines, []
+            dropped, self.dropped = self.dropped, 0
+
+        if dropped:
+            counters["telemetry.dropped"] = counters.get("telemetry.dropped", 0) + dropped
+
+        metrics = []
+        for name, value in counters.items():
+            metrics.append(self.prefix + "." + name + ":" + str(value) + "|c")
+        for name, value in gauges.items():
+            metrics.append(self.prefix + "." + name + ":" + str(value) + "|g")
+        for line in timers:
+            metrics.append(self.prefix + "." + line)
+
+        if self.statsd is not None:
+            self.send_lines(metrics, self.statsd)
+
+        if self.logs is not None:
+            self.send_lines(log_lines, self.logs)
+
+    def send_lines(self, lines, address):
+        """
+        Send lines newline separated, in as few datagrams as fit within MAX_DATAGRAM.
+        """
+        batch = bytearray()
+
+        for line in lines:
+            data = line.encode()
+            if batch and len(batch) + 1 + len(data) > self.MAX_DATAGRAM:
+                self.send_datagram(batch, address)
+                batch = bytearray()
+
+            if batch:
+                batch += b"\n"
+            batch += data[:self.MAX_DATAGRAM]
+
+        if batch:
+            self.send_datagram(batch, address)
+
+    def send_datagram(self, data, address):
+        try:
+            self.sock.sendto(data, address)
+        except OSError as e:
+            # Telemetry is best effort, never let an unreachable server take down the caller
+            print("Telemetry send to " + address[0] + ":" + str(address[1]) + " failed: " + str(e))
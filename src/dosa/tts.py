@@ -2,38 +2,662 @@
 
 from boto3 import Session
 from botocore.exceptions import BotoCoreError, ClientError
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import closing
+import collections
+import heapq
+import itertools
+import json
+import math
 import os
+import tempfile
 import subprocess
 import hashlib
+import threading
+import time
+
+from dosa.metrics import NULL as NULL_METRICS
+
+
+class Priority:
+    """
+    Announcement priorities, lower values are announced first.
+    """
+    SECURITY = 0
+    ALERT = 10
+    NOTICE = 20
+
+
+class Announcement:
+    def __init__(self, msg, priority, seq):
+        self.msg = msg
+        self.priority = priority
+        self.seq = seq
+        self.cancelled = False
+
+
+class AudioCache:
+    """
+    In-memory LRU cache of decoded audio, capped by total size in bytes.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            audio = self.entries.get(key)
+            if audio is not None:
+                self.entries.move_to_end(key)
+
+            return audio
+
+    def put(self, key, audio):
+        if len(audio) > self.max_bytes:
+            return
+
+        with self.lock:
+            self.discard_locked(key)
+            self.entries[key] = audio
+            self.size += len(audio)
+
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def discard(self, key):
+        with self.lock:
+            self.discard_locked(key)
+
+    def discard_locked(self, key):
+        audio = self.entries.pop(key, None)
+        if audio is not None:
+            self.size -= len(audio)
+
+
+class Clip:
+    def __init__(self, audio, priority, seq):
+        self.audio = audio
+        self.priority = priority
+        self.seq = seq
+        self.queued_at = time.monotonic()
+        self.started_at = None
+        self.cancelled = False
+        self.interrupted = False
+        self.done = threading.Event()
+
+
+class AudioSink:
+    """
+    Plays all audio through one long-lived out123 process fed signed 16-bit mono PCM on stdin.
+
+    Clips are played one at a time in priority order. Audio is written in short chunks paced to real time, so that
+    little is ever buffered ahead of the speaker - this keeps clips cancellable, and a higher priority clip interrupts
+    a lower priority one that is playing.
+    """
+    CHUNK_SECONDS = 0.1
+
+    # How far ahead of real time audio is written
+    LEAD_SECONDS = 0.25
+
+    def __init__(self, sample_rate):
+        self.sample_rate = sample_rate
+        self.bytes_per_second = sample_rate * 2
+        self.player = None
+        self.queue = []
+        self.counter = itertools.count()
+        self.cv = threading.Condition()
+        self.worker = None
+        self.running = False
+        self.current = None
+
+        # Time from queueing to start of playback of the most recent clip, and running totals
+        self.latency = None
+        self.played = 0
+        self.interrupted = 0
+        self.metrics = NULL_METRICS
+
+    def play(self, audio, priority=Priority.NOTICE):
+        """
+        Queue a clip, returns the Clip whose `done` event is set once it has finished or been cancelled.
+        """
+        clip = Clip(audio, priority, next(self.counter))
+
+        with self.cv:
+            heapq.heappush(self.queue, (priority, clip.seq, clip))
+            self.cv.notify()
+
+            if self.worker is None:
+                self.running = True
+                self.worker = threading.Thread(target=self.run_worker, name="audio-sink", daemon=True)
+                self.worker.start()
+
+        return clip
+
+    def cancel(self, clip):
+        with self.cv:
+            clip.cancelled = True
+            self.cv.notify()
+
+    def depth(self):
+        """
+        Number of clips waiting to be played.
+        """
+        with self.cv:
+            return sum(1 for _, _, clip in self.queue if not clip.cancelled)
+
+    def stop(self):
+        with self.cv:
+            self.running = False
+            for _, _, clip in self.queue:
+                clip.cancelled = True
+                clip.done.set()
+            self.queue.clear()
+            self.cv.notify()
+
+        if self.worker is not None:
+            self.worker.join()
+            self.worker = None
+
+        if self.player is not None:
+            try:
+                self.player.stdin.close()
+            except OSError:
+                pass
+            self.player.wait()
+            self.player = None
+
+    def kill_player(self):
+        """
+        Kill and reap a broken player, so it's neither left running nor a zombie.
+        """
+        player, self.player = self.player, None
+        if player is None:
+            return
+
+        try:
+            player.stdin.close()
+        except OSError:
+            pass
+
+        player.kill()
+        player.wait()
+
+    def get_player(self):
+        if self.player is None or self.player.poll() is not None:
+            cmd = ["out123", "-q", "-r", str(self.sample_rate), "-c", "1", "-e", "s16"]
+            self.player = subprocess.Popen(cmd, shell=False, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                           stderr=subprocess.DEVNULL, close_fds=True)
+
+        return self.player
+
+    def is_preempted(self, clip):
+        """
+        True if the clip was cancelled, or a higher priority clip is waiting. Caller must hold the lock.
+        """
+        if clip.cancelled or not self.running:
+            return True
+
+        return bool(self.queue) and self.queue[0][0] < clip.priority
+
+    def run_worker(self):
+        while True:
+            with self.cv:
+                while self.running and not self.queue:
+                    self.cv.wait()
+
+                if not self.running:
+                    return
+
+                _, _, clip = heapq.heappop(self.queue)
+                if clip.cancelled:
+                    clip.done.set()
+                    continue
+
+                self.current = clip
+
+            try:
+                self.play_clip(clip)
+            except (BrokenPipeError, OSError) as e:
+                # The player will be restarted for the next clip
+                print("Audio playback fault: " + str(e))
+                self.kill_player()
+            finally:
+                self.current = None
+                clip.done.set()
+
+    def play_clip(self, clip):
+        player = self.get_player()
+        chunk = int(self.bytes_per_second * self.CHUNK_SECONDS) & ~1
+        clip.started_at = time.monotonic()
+        self.latency = clip.started_at - clip.queued_at
+        self.metrics.histogram("tts_queue_seconds", "Time announcements wait for the audio sink").observe(
+            self.latency)
+        written = 0.0
+
+        for offset in range(0, len(clip.audio), chunk):
+            with self.cv:
+                # Write ahead of real time by no more than the lead, waking early for new clips or cancellation
+                while True:
+                    if self.is_preempted(clip):
+                        clip.interrupted = True
+                        self.interrupted += 1
+                        return
+
+                    ahead = written - (time.monotonic() - clip.started_at) - self.LEAD_SECONDS
+                    if ahead <= 0:
+                        break
+                    self.cv.wait(ahead)
+
+            data = clip.audio[offset:offset + chunk]
+            player.stdin.write(data)
+            player.stdin.flush()
+            written += len(data) / self.bytes_per_second
+
+        self.played += 1
+
+        # Hold the sink until the clip has actually been heard
+        remaining = written - (time.monotonic() - clip.started_at)
+        if remaining > 0:
+            time.sleep(remaining)
+
+        self.metrics.histogram("tts_playback_seconds", "Time announcements spend playing").observe(
+            time.monotonic() - clip.started_at)
+
+
+class TtsCache:
+    """
+    The on-disk cache of synthesised audio, tracked by a manifest of hash -> size, voice, engine and last use.
+
+    The manifest is loaded once, so checking for a phrase costs no syscalls. Files and the manifest are written to a
+    temp file and renamed into place, so a failed write never leaves a partial file in the cache. The cache is held
+    under `max_bytes` by evicting the least recently used entries, and entries unused for `max_age` seconds are pruned.
+    """
+    MANIFEST = "manifest.json"
+    PATH = os.path.join(os.path.expanduser("~"), ".dosa", "tts-cache")
+
+    def __init__(self, path, extension="mp3", max_bytes=256 * 1024 * 1024, max_age=90 * 86400):
+        self.path = path
+        self.extension = extension
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.entries = {}
+        self.lock = threading.RLock()
+        self.dirty = False
+        self.load()
+
+    def file(self, msg_hash):
+        return os.path.join(self.path, msg_hash + "." + self.extension)
+
+    def load(self):
+        """
+        Load the manifest, rebuilding it from the cache directory if it is missing or unreadable.
+        """
+        try:
+            with open(os.path.join(self.path, self.MANIFEST), "r") as manifest:
+                self.entries = json.load(manifest)
+            return
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print("TTS cache manifest unreadable, rebuilding: " + str(e))
+
+        self.entries = {}
+        for msg_hash, size, mtime in self.scan():
+            self.entries[msg_hash] = {"size": size, "voice": None, "engine": None, "created": mtime,
+                                      "last-used": mtime}
+        self.dirty = True
+
+    def scan(self):
+        """
+        Yield (hash, size, mtime) for every audio file in the cache directory.
+        """
+        try:
+            names = os.listdir(self.path)
+        except FileNotFoundError:
+            return
+
+        for name in names:
+            msg_hash, ext = os.path.splitext(name)
+            if ext != "." + self.extension:
+                continue
+
+            stat = os.stat(os.path.join(self.path, name))
+            yield msg_hash, stat.st_size, stat.st_mtime
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+
+            self.write_atomic(os.path.join(self.path, self.MANIFEST), json.dumps(self.entries).encode())
+            self.dirty = False
+
+    def write_atomic(self, path, data):
+        os.makedirs(self.path, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.path, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def has(self, msg_hash):
+        # The manifest can outlive its file, if the cache directory was cleaned by hand
+        return msg_hash in self.entries and os.path.exists(self.file(msg_hash))
+
+    def touch(self, msg_hash):
+        with self.lock:
+            entry = self.entries.get(msg_hash)
+            if entry is not None:
+                entry["last-used"] = time.time()
+                self.dirty = True
+
+    def size(self):
+        with self.lock:
+            return sum(entry["size"] for entry in self.entries.values())
+
+    def put(self, msg_hash, data, voice, engine):
+        """
+        Atomically add a synthesised file to the cache, evicting old entries if the cache is now too large.
+        """
+        self.write_atomic(self.file(msg_hash), data)
+        now = time.time()
+
+        with self.lock:
+            self.entries[msg_hash] = {"size": len(data), "voice": voice, "engine": engine, "created": now,
+                                      "last-used": now}
+            self.dirty = True
+
+            if self.size() > self.max_bytes:
+                self.prune(max_age=math.inf)
+
+            self.save()
+
+    def remove(self, msg_hash):
+        with self.lock:
+            self.entries.pop(msg_hash, None)
+            self.dirty = True
+
+        try:
+            os.unlink(self.file(msg_hash))
+        except FileNotFoundError:
+            pass
+
+    def prune(self, max_bytes=None, max_age=None):
+        """
+        Evict entries unused for `max_age` seconds, then least recently used entries until under `max_bytes`.
+
+        A limit of None is that of the cache, pass math.inf to skip a limit. Returns the evicted hashes.
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        max_age = self.max_age if max_age is None else max_age
+        evicted = []
+
+        with self.lock:
+            by_use = sorted(self.entries.items(), key=lambda item: item[1]["last-used"])
+            total = self.size()
+            cutoff = time.time() - max_age
+
+            for msg_hash, entry in by_use:
+                if entry["last-used"] >= cutoff and total <= max_bytes:
+                    break
+
+                self.remove(msg_hash)
+                total -= entry["size"]
+                evicted.append(msg_hash)
+
+            self.save()
+
+        return evicted
+
+    def verify(self):
+        """
+        Check every cached file against the manifest, removing entries whose file is missing, the wrong size or not
+        valid audio. Files not in the manifest are adopted if valid and otherwise deleted, as are stray temp files.
+
+        Returns a list of (hash, reason) for everything removed.
+        """
+        removed = []
+
+        with self.lock:
+            on_disk = {msg_hash: size for msg_hash, size, _ in self.scan()}
+
+            for msg_hash, entry in list(self.entries.items()):
+                if msg_hash not in on_disk:
+                    reason = "missing"
+                elif on_disk[msg_hash] != entry["size"]:
+                    reason = "size mismatch"
+                elif not self.is_valid(msg_hash):
+                    reason = "invalid audio"
+                else:
+                    continue
+
+                self.remove(msg_hash)
+                removed.append((msg_hash, reason))
+
+            for msg_hash, size in on_disk.items():
+                if msg_hash in self.entries:
+                    continue
+
+                if self.is_valid(msg_hash):
+                    now = time.time()
+                    self.entries[msg_hash] = {"size": size, "voice": None, "engine": None, "created": now,
+                                              "last-used": now}
+                    self.dirty = True
+                else:
+                    self.remove(msg_hash)
+                    removed.append((msg_hash, "invalid audio"))
+
+            for name in os.listdir(self.path) if os.path.isdir(self.path) else []:
+                if name.startswith(".tmp-"):
+                    os.unlink(os.path.join(self.path, name))
+
+            self.save()
+
+        return removed
+
+    def is_valid(self, msg_hash):
+        """
+        True if the file starts with an ID3 tag or an MPEG audio frame sync.
+        """
+        try:
+            with open(self.file(msg_hash), "rb") as file:
+                head = file.read(3)
+        except OSError:
+            return False
+
+        return head == b"ID3" or (len(head) >= 2 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0)
 
 
 class Tts:
-    def __init__(self, voice="Amy", engine="neural"):
+    # Audio is decoded to signed 16-bit mono PCM at this rate for the in-memory cache and playback
+    SAMPLE_RATE = 22050
+
+    def __init__(self, voice="Amy", engine="neural", memory_cache=32 * 1024 * 1024, prewarm_workers=4,
+                 cache_size=256 * 1024 * 1024, cache_age=90 * 86400):
         self.voice = voice
         self.engine = engine
         self.output_format = "mp3"
-        self.tts_cache = os.path.join(os.path.expanduser("~"), ".dosa", "tts-cache")
+        self.tts_cache = TtsCache.PATH
+        self.cache = TtsCache(self.tts_cache, self.output_format, max_bytes=cache_size, max_age=cache_age)
+        self.audio = AudioCache(memory_cache)
+        self.metrics = NULL_METRICS
+
+        # Hashes being synthesised right now, so concurrent requests for one phrase only call Polly once
+        self.inflight = {}
+        self.inflight_lock = threading.Lock()
+        self.prewarm_pool = None
+        self.prewarm_workers = prewarm_workers
+        self.sink = AudioSink(self.SAMPLE_RATE)
 
         # Create a client using the credentials and region defined in the [dosa] section of the AWS credentials
         # file (~/.aws/credentials)
         self.session = Session(profile_name="dosa")
         self.polly = self.session.client("polly")
 
-    def play(self, msg, wait=False, no_cache=False):
+        # Announcement queue, a heap of (priority, seq, Announcement) drained by a worker thread
+        self.queue = []
+        self.queued = {}
+        self.counter = itertools.count()
+        self.cv = threading.Condition()
+        self.worker = None
+        self.running = False
+
+    def announce(self, msg, priority=Priority.NOTICE):
+        """
+        Queue a message to be synthesised and played by the worker thread, returning immediately.
+
+        Higher priority messages are played ahead of lower priority ones. A message that is already queued is merged
+        with the queued copy, keeping the higher of the two priorities.
+        """
+        with self.cv:
+            queued = self.queued.get(msg)
+            if queued is not None:
+                if queued.priority <= priority:
+                    return
+                queued.cancelled = True
+
+            announcement = Announcement(msg, priority, next(self.counter))
+            self.queued[msg] = announcement
+            heapq.heappush(self.queue, (priority, announcement.seq, announcement))
+            self.cv.notify()
+
+            if self.worker is None:
+                self.running = True
+                self.worker = threading.Thread(target=self.run_worker, name="tts", daemon=True)
+                self.worker.start()
+
+    def pending(self):
+        """
+        Number of announcements waiting to be played.
+        """
+        with self.cv:
+            return len(self.queued)
+
+    def stop(self):
+        """
+        Stop the worker thread once the announcement in progress has finished, discarding the queue and any pending
+        pre-warming.
+        """
+        with self.cv:
+            self.running = False
+            self.queue.clear()
+            self.queued.clear()
+            self.cv.notify()
+
+        if self.worker is not None:
+            self.worker.join()
+            self.worker = None
+
+        if self.prewarm_pool is not None:
+            self.prewarm_pool.shutdown(cancel_futures=True)
+            self.prewarm_pool = None
+
+        self.sink.stop()
+        self.cache.save()
+
+    def run_worker(self):
+        while True:
+            with self.cv:
+                while self.running and not self.queue:
+                    self.cv.wait()
+
+                if not self.running:
+                    return
+
+                _, _, announcement = heapq.heappop(self.queue)
+                if announcement.cancelled:
+                    continue
+
+                del self.queued[announcement.msg]
+
+            # Playback is handed to the sink, so the next announcement can be synthesised while this one plays
+            try:
+                self.play(announcement.msg, priority=announcement.priority)
+            except Exception as e:
+                # Polly or playback failures lose the announcement, but must not stop the worker
+                print("TTS fault: " + str(e))
+
+    def play(self, msg, wait=False, no_cache=False, priority=Priority.NOTICE):
+        clip = self.sink.play(self.prepare_audio(msg, no_cache=no_cache), priority)
+        if wait:
+            clip.done.wait()
+
+        return clip
+
+    def prepare(self, msg, no_cache=False):
+        """
+        Make sure a message is in the disk cache, synthesising it if needed, and return its hash.
+        """
         msg_hash = self.get_msg_hash(msg)
-        if no_cache or not self.has_cache(msg_hash):
+
+        with self.inflight_lock:
+            done = self.inflight.get(msg_hash)
+            if done is None:
+                if not no_cache and self.has_cache(msg_hash):
+                    return msg_hash
+
+                done = self.inflight[msg_hash] = threading.Event()
+                owner = True
+            else:
+                owner = False
+
+        if not owner:
+            done.wait()
+            return msg_hash
+
+        try:
             self.synthesise(msg)
-        self.play_from_cache(msg_hash, wait=wait)
+            self.audio.discard(msg_hash)
+        finally:
+            with self.inflight_lock:
+                del self.inflight[msg_hash]
+            done.set()
+
+        return msg_hash
+
+    def prewarm(self, phrases):
+        """
+        Synthesise and decode phrases in the background so they can be played without delay later.
+
+        Phrases are spread over a small pool of threads, returns a future per phrase which resolves to False if the
+        phrase could not be prepared.
+        """
+        if self.prewarm_pool is None:
+            self.prewarm_pool = ThreadPoolExecutor(max_workers=self.prewarm_workers, thread_name_prefix="tts-prewarm")
+
+        return [self.prewarm_pool.submit(self.warm, msg) for msg in set(phrases)]
+
+    def warm(self, msg):
+        try:
+            self.prepare_audio(msg)
+            return True
+        except Exception as e:
+            print("TTS pre-warm failed for '" + msg + "': " + str(e))
+            return False
+
+    def set_metrics(self, metrics):
+        """
+        Record synthesis and playback times in a dosa.metrics.Metrics registry.
+        """
+        self.metrics = metrics
+        self.sink.metrics = metrics
 
     def get_msg_hash(self, msg):
         key = self.voice + "|" + self.engine + "|" + msg
         return hashlib.md5(key.encode('utf-8')).hexdigest()
 
     def has_cache(self, msg_hash):
-        return os.path.isfile(os.path.join(self.tts_cache, msg_hash + "." + self.output_format))
+        return self.cache.has(msg_hash)
 
     def synthesise(self, msg):
+        start = time.perf_counter()
         try:
             response = self.polly.synthesize_speech(Text=msg, OutputFormat=self.output_format, VoiceId=self.voice,
                                                     Engine=self.engine)
@@ -42,30 +666,56 @@ class Tts:
 
         # Access the audio stream from the response
         if "AudioStream" in response:
-            # Check/create the audio cache file
-            if not os.path.exists(self.tts_cache):
-                os.makedirs(self.tts_cache)
-
             # Note: Closing the stream is important because the service throttles on the  number of parallel
             # connections. Here we are using contextlib.closing to ensure the close method of the stream object will be
             # called automatically at the end of the with statement's scope.
             with closing(response["AudioStream"]) as stream:
-                output = os.path.join(self.tts_cache, self.get_msg_hash(msg) + "." + self.output_format)
+                data = stream.read()
 
-                try:
-                    # Open a file for writing the output as a binary stream
-                    with open(output, "wb") as file:
-                        file.write(stream.read())
-                except IOError:
-                    raise Exception("IO Error")
+            self.metrics.histogram("tts_synthesis_seconds", "Time to synthesise an announcement with Polly").observe(
+                time.perf_counter() - start)
+
+            try:
+                self.cache.put(self.get_msg_hash(msg), data, self.voice, self.engine)
+            except IOError:
+                raise Exception("IO Error")
 
         else:
             raise Exception("Audio stream not in response!")
 
-    def play_from_cache(self, msg_hash, wait=False):
-        cmd = ["mpg123", os.path.join(self.tts_cache, msg_hash + "." + self.output_format)]
+    def prepare_audio(self, msg, no_cache=False):
+        """
+        Decoded PCM for a message, synthesising it again if the cached file will not decode.
+        """
+        msg_hash = self.prepare(msg, no_cache=no_cache)
+        try:
+            return self.load_audio(msg_hash)
+        except subprocess.CalledProcessError:
+            print("TTS cache entry for '" + msg + "' is corrupt, synthesising it again")
+            self.cache.remove(msg_hash)
+            return self.load_audio(self.prepare(msg, no_cache=True))
+
+    def load_audio(self, msg_hash):
+        """
+        Decoded PCM for a cached message, from memory if possible or else decoded from the disk cache.
+        """
+        audio = self.audio.get(msg_hash)
+        if audio is None:
+            cmd = ["mpg123", "-q", "-s", "-m", "-r", str(self.SAMPLE_RATE), "-e", "s16",
+                   os.path.join(self.tts_cache, msg_hash + "." + self.output_format)]
+            audio = subprocess.run(cmd, capture_output=True, check=True).stdout
+            self.audio.put(msg_hash, audio)
+
+        self.cache.touch(msg_hash)
+
+        return audio
+
+    def play_from_cache(self, msg_hash, wait=False, priority=Priority.NOTICE):
+        """
+        Queue a cached message on the audio sink, returning its Clip.
+        """
+        clip = self.sink.play(self.load_audio(msg_hash), priority)
         if wait:
-            subprocess.run(cmd, capture_output=True)
-        else:
-            subprocess.Popen(cmd, shell=False, stdin=None, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
-                             close_fds=True)
+            clip.done.wait()
+
+        return clip